@@ -0,0 +1,243 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import atexit
+# Needed to flush the last touches when the process exits
+
+import redis
+# The thread survives the redis errors
+
+from datetime import datetime as dt
+# Needed to save the last activity
+
+from threading import Event, Lock, Thread
+# The touches are flushed by a background thread
+
+from typing import Dict, List, Union
+# Needed for parameters and return hints
+
+from source.objects.redis_connection import setting
+# The tracker is configured in the redis config category
+
+from source.objects.storage import get_storage
+# Where the users are saved, redis by default
+
+
+class ActivityTracker:
+    """Buffers the last activity of the users in memory and writes it to
+    the storage at once. On redis it's a single pipeline that writes both
+    the last_activity field of the user hash and the users:activity sorted
+    set. The touches of the same user between two flushes are coalesced.
+
+    Attributes
+    ----------
+    interval : float
+        How many seconds pass between two flushes
+    max_buffered : int
+        How many users can be buffered before flushing immediately
+
+    Methods
+    -------
+    touch(user_id: int, timestamp: float = None, block: bool = True)
+        Buffer the activity of a user
+    flush()
+        Write the buffered activity to redis
+    start()
+        Start flushing every interval seconds in a daemon thread
+    stop()
+        Stop the thread and flush
+    count_since(timestamp: float)
+        Count the users active since a time
+    active_since(timestamp: float, start: int = 0, num: int = None)
+        Get the ids of the users active since a time
+    """
+
+    def __init__(self, interval: float = 0.5, max_buffered: int = 1000):
+        """
+        Parameters
+        ----------
+        interval : float, optional
+            How many seconds pass between two flushes
+        max_buffered : int, optional
+            How many users can be buffered before flushing immediately
+        """
+        self.interval = interval
+        self.max_buffered = max_buffered
+        self._buffer: Dict[int, float] = dict()
+        self._lock = Lock()
+        self._stopped = Event()
+        self._wake = Event()
+        # Set to flush before the interval ends
+        self._thread: Union[Thread, None] = None
+
+    def touch(self, user_id: int, timestamp: Union[float, None] = None,
+              block: bool = True) -> float:
+        """Buffer the activity of a user, flushing if the buffer is full
+
+        Parameters
+        ----------
+        user_id : int
+            The Telegram ID of the user
+        timestamp : float, optional
+            When the user was active, now by default
+        block : bool, optional
+            If the buffer is full flush it now, otherwise wake the thread to
+            flush it, like the asyncio code must do to not block the loop
+
+        Returns
+        -------
+        float
+            The timestamp buffered
+        """
+        if timestamp is None:
+            timestamp = dt.timestamp(dt.now())
+        with self._lock:
+            self._buffer[user_id] = timestamp
+            full = len(self._buffer) >= self.max_buffered
+        if full and block:
+            self.flush()
+        elif full:
+            self._wake.set()
+        return timestamp
+
+    def flush(self) -> int:
+        """Write the buffered activity to the storage at once. If the write
+        fails the activity is buffered again, to be written by the next
+        flush
+
+        Returns
+        -------
+        int
+            How many users were written
+        """
+        with self._lock:
+            buffer, self._buffer = self._buffer, dict()
+        if not buffer:
+            return 0
+        try:
+            get_storage().touch(buffer)
+        except BaseException:
+            self._restore(buffer)
+            raise
+        return len(buffer)
+
+    def _restore(self, buffer: Dict[int, float]):
+        """Buffer again the activity not written, unless the users were
+        touched again meanwhile"""
+        with self._lock:
+            for user_id, timestamp in buffer.items():
+                if self._buffer.get(user_id, timestamp) <= timestamp:
+                    self._buffer[user_id] = timestamp
+
+    def _run(self):
+        """Flush every interval seconds, or when woken, until stopped"""
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                return
+            try:
+                self.flush()
+            except redis.RedisError:
+                pass        # Still buffered, retried on the next interval
+
+    def start(self):
+        """Start flushing every interval seconds in a daemon thread, if not
+        already started, and flush when the process exits"""
+        if self._thread is None:
+            self._stopped.clear()
+            self._wake.clear()
+            self._thread = Thread(target=self._run, daemon=True,
+                                  name="activity-tracker")
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the thread, if started, and flush the buffered activity"""
+        if self._thread is not None:
+            self._stopped.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+            atexit.unregister(self.stop)
+        self.flush()
+
+    def count_since(self, timestamp: float) -> int:
+        """Count the users active since a time, with a single ZCOUNT on redis
+
+        Parameters
+        ----------
+        timestamp : float
+            The oldest activity counted
+
+        Returns
+        -------
+        int
+            How many users were active
+        """
+        return get_storage().count_active(timestamp)
+
+    def active_since(self, timestamp: float, start: int = 0,
+                     num: Union[int, None] = None) -> List[int]:
+        """Get the ids of the users active since a time, the least recently
+        active first, with a single ZRANGEBYSCORE on redis
+
+        Parameters
+        ----------
+        timestamp : float
+            The oldest activity returned
+        start : int, optional
+            How many users are skipped, to read the users in pages
+        num : int, optional
+            How many users are returned, all by default
+
+        Returns
+        -------
+        List[int]
+            The Telegram IDs of the users
+        """
+        return get_storage().active_since(timestamp, start, num)
+
+
+_tracker: Union[ActivityTracker, None] = None
+
+
+def get_tracker() -> ActivityTracker:
+    """Get the activity tracker of the process, created and started on the
+    first call from the activity-flush-interval (in milliseconds) and the
+    activity-max-buffered keys of the redis config category
+
+    Returns
+    -------
+    ActivityTracker
+        The started tracker
+    """
+
+    global _tracker
+    if _tracker is None:
+        _tracker = ActivityTracker(
+            float(setting("activity-flush-interval", 500)) / 1000,
+            int(setting("activity-max-buffered", 1000)))
+        _tracker.start()
+    return _tracker
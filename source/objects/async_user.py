@@ -0,0 +1,300 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from botogram import User as bUser
+# Get a botogram.User class and save it as bUser
+
+from typing import Union
+# Needed for parameters and return hints
+
+from uuid import uuid4
+# Needed to sign the invalidations sent to the user caches
+
+from source.objects.redis_connection import (get_async_redis, get_nodes,
+                                             setting)
+# The shared asyncio redis connection, created on first use
+
+from source.objects.user import BaseUser, new_user, user_id
+# The same fields of User
+
+from source.objects.storage.redis_storage import (CREATE_USER, STATE_SET,
+                                                  TRANSITION, script_args,
+                                                  transition_args)
+# The same hash layout and scripts of the redis storage of User
+
+from source.objects.user_cache import CHANNEL
+# Where the processes using a UserCache listen for changed users
+
+from source.objects.activity import get_tracker
+# Writes the last activity of the users in batches
+
+from source.objects.user_encoding import (decode, encode_value, field,
+                                          read_fields, twin)
+# The user hashes can be written with the compact encoding
+
+
+class AsyncUser(BaseUser):
+    """A Telegram user in the redis database, like User, for asyncio code.
+    It's got with AsyncUserStore.get and uses the same user:{id} hash, so
+    User with the redis storage and AsyncUser can work on the same users.
+
+    Attributes
+    ----------
+    id : int
+        An Integer representing the user's Telegram ID
+    first_name : str
+        A string representing the users's First Name on Telegram
+    last_name : str
+        A string representing the user's Last Name on Telegram, "" if the
+        user doesn't have a last name on Telegram
+    username : str
+        A string representing the user's Username on Telegram, "" if the
+        user doesn't have an username on Telegram
+    last_activity : float
+        User's last activity on the BOT
+
+    Methods
+    -------
+    state(new_state: str = "")
+        Sets a new state for the user or returns the current one
+    """
+    __slots__ = ("id", "redis_hash", "_store", "_state", "first_name",
+                 "last_name", "username", "last_activity")
+
+    def __init__(self, store: "AsyncUserStore", telegram_id: int,
+                 data: dict):
+        """Initializes the user from its hash, use AsyncUserStore.get
+
+        Parameters
+        ----------
+        store : AsyncUserStore
+            The store the user was got from
+        telegram_id : int
+            The Telegram ID of the user
+        data : dict
+            The fields of the user hash
+        """
+
+        self.id = telegram_id
+        self.redis_hash = f"user:{telegram_id}"
+        self._store = store
+        self._load(data)
+
+    async def _get_redis_value(self, key: str, type_of_return: type = str
+                               ) -> Union[str, int, float]:
+        """Get a field of the user hash, like User._get_redis_value
+
+        Parameters
+        ----------
+        key : str
+            The key to get from redis
+        type_of_return : type, optional
+            How to return the value, either as a str, an int or a float,
+            defaults to str
+
+        Returns
+        -------
+        Union[str, int, float]
+            The value which corresponds to the provided key
+
+        Raises
+        ------
+        TypeError
+            If the requested value is not an int or a float, and it's
+            requested as such, raise a TypeError
+        """
+
+        values = await self._store.client.hmget(self.redis_hash,
+                                                read_fields(key))
+        value = next((item for item in values if item is not None), None)
+        # The field in any encoding
+        return self._cast(value, type_of_return)
+
+    async def _set_redis_value(self, key: str,
+                               value: Union[str, int, float]) -> bool:
+        """Set a field of the user hash, like User._set_redis_value
+
+        Parameters
+        ----------
+        key : str
+            The key to set on redis
+        value : Union[str, int, float]
+            The value to set on that key
+
+        Returns
+        -------
+        bool
+            True if a new entry was created, False if an existing key was
+            altered
+        """
+
+        pipe = self._store.client.pipeline(transaction=False)
+        pipe.hset(self.redis_hash, field(key), encode_value(key, value))
+        if twin(key):
+            pipe.hdel(self.redis_hash, twin(key))
+            # Never keep a field in both encodings
+        if self._store.invalidate:
+            pipe.publish(CHANNEL, f"{self._store.token} {self.id}")
+            # Drop the user from the cache of the sync processes
+        return (await pipe.execute())[0]
+
+    async def state(self, new_state: str = "",
+                    expected: Union[str, None] = None) -> Union[str, bool]:
+        """Sets a new user state, like User.state, or returns the current
+        one if no new one is provided
+
+        Parameters
+        ----------
+        new_state : str, optional
+            The new state to be set, the current state is returned if it's
+            not provided
+        expected : str, None, optional
+            Set the new state only if the current one is this, whatever it
+            is if None
+
+        Returns
+        -------
+        Union[str, bool]
+            Returns a str representing the user's state, True if the
+            state was set successfully or False if the current state wasn't
+            the expected one
+
+        Raises
+        ------
+        ValueError
+            If the user was deleted from redis
+        """
+
+        if not new_state:
+            return await self._get_redis_value("state")
+
+        store = self._store
+        args = transition_args(self.id, new_state, expected)
+        if not store.invalidate:
+            done, current = await store.transition(keys=[self.redis_hash],
+                                                   args=args)
+        else:
+            pipe = store.client.pipeline(transaction=False)
+            await store.transition(keys=[self.redis_hash], args=args,
+                                   client=pipe)
+            pipe.publish(CHANNEL, f"{store.token} {self.id}")
+            (done, current), _ = await pipe.execute()
+
+        if done < 0:
+            raise ValueError("User not found in the redis database")
+        self._state = new_state if done else current
+        return bool(done)
+
+
+class AsyncUserStore:
+    """Creates and loads the AsyncUser objects. Every user shares the
+    connections of a single asyncio redis client, so the users can't be
+    sharded on many nodes.
+
+    Attributes
+    ----------
+    client : redis.asyncio.Redis
+        The asyncio redis client
+    invalidate : bool
+        If the users written are published to the user caches
+
+    Methods
+    -------
+    get(botogram_user: bUser = None, telegram_id: int = 0)
+        Get a user, creating it if needed
+    """
+
+    def __init__(self, client=None, invalidate: Union[bool, None] = None):
+        """
+        Parameters
+        ----------
+        client : redis.asyncio.Redis, optional
+            The asyncio redis client, the shared one by default
+        invalidate : bool, None, optional
+            If the users written are published to the user caches, by
+            default if user-cache-size is set in the redis config category
+
+        Raises
+        ------
+        ValueError
+            If the nodes key of the redis config category is set: User
+            would read and write the users on their nodes, this store on a
+            single one
+        """
+
+        if get_nodes():
+            raise ValueError("AsyncUserStore can't be used with the users "
+                             "sharded on the nodes of the redis config")
+        self.client = client if client is not None else get_async_redis()
+        self.invalidate = (int(setting("user-cache-size", 0)) > 0
+                           if invalidate is None else invalidate)
+        self.token = uuid4().hex
+        self._create_user = self.client.register_script(CREATE_USER)
+        self.transition = self.client.register_script(TRANSITION)
+
+    async def get(self, botogram_user: bUser = None, telegram_id: int = 0
+                  ) -> AsyncUser:
+        """Get a user from redis, creating it if a botogram User is passed
+        and it's not present, with the same rules of User
+
+        Parameters
+        ----------
+        botogram_user : botogram.User, optional
+            The Telegram user to be saved/recalled from redis, leave empty to
+            use the Telegram id
+        telegram_id : int, optional
+            The Telegram ID of the user to be recalled from redis, leave empty
+            to use the botogram User
+
+        Returns
+        -------
+        AsyncUser
+            The user
+
+        Raises
+        ------
+        ValueError
+            If neither the botogram_user nor telegram_id is provided, if both
+            are provided and don't match or if only the telegram_id is
+            provided and the user is not present
+        """
+
+        telegram_id = user_id(botogram_user, telegram_id)
+        data = decode(await self.client.hgetall(f"user:{telegram_id}"))
+        if not data.get("id"):
+            if not botogram_user:
+                raise ValueError("User not found in the redis database,"
+                                 " cannot utilize the telegram id")
+            fields = new_user(botogram_user)
+            reply = await self._create_user(
+                keys=[f"user:{telegram_id}", STATE_SET + fields["state"]],
+                args=script_args(fields))
+            data = decode(dict(zip(reply[::2], reply[1::2]))) or fields
+            # The existing hash if another update created the user first
+        user = AsyncUser(self, telegram_id, data)
+        if botogram_user:            # If the user is sending an update
+            user.last_activity = get_tracker().touch(telegram_id,
+                                                     block=False)
+            # Flushed by the tracker thread, not in the event loop
+        return user
@@ -0,0 +1,128 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import json
+# Needed to read and write the cache file
+
+import os
+from os import path as p
+# Needed to read the environment and to write the cache file atomically
+
+from time import time
+# Needed to expire the cache file
+
+from typing import Union
+# Needed for parameters and return hints
+
+from source.objects.redis_connection import setting
+# The telegram config category, read on first use
+
+CACHE_PATH = "./data/cache/bot_username.json"
+# Where the username is saved between restarts
+CACHE_TTL = 24 * 60 * 60
+# How many seconds the saved username is trusted
+
+_username: Union[str, None] = None
+# The username resolved by this process
+
+
+def _from_settings() -> Union[str, None]:
+    """Get the username set in the environment or in the config file"""
+    return (os.getenv("BOT-USERNAME")
+            or setting("bot-username", category="telegram"))
+
+
+def _from_cache(path: str, ttl: float) -> Union[str, None]:
+    """Get the username saved in the cache file, if not expired"""
+    try:
+        with open(path, encoding="utf8") as j:
+            cached = json.load(j)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or time() - cached.get("time", 0) > ttl:
+        return None
+    return cached.get("username") or None
+
+
+def _to_cache(path: str, username: str):
+    """Save the username in the cache file, ignoring write errors"""
+    try:
+        os.makedirs(p.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf8") as j:
+            json.dump({"username": username, "time": time()}, j)
+        os.replace(path + ".tmp", path)
+        # Concurrent workers never read a half-written file
+    except OSError:
+        pass
+
+
+def _from_telegram() -> str:
+    """Ask the username to Telegram with getMe"""
+    from botogram import create
+    # Imported here since only the first worker needs it
+
+    return create(setting("bot-token", category="telegram")).itself.username
+
+
+def get_bot_username(path: str = CACHE_PATH, ttl: float = CACHE_TTL) -> str:
+    """Get the username of the bot. It's resolved on the first call, from
+    the BOT-USERNAME environment variable, the bot-username key of the
+    telegram config category, the cache file or, if none of them is set,
+    with a getMe request to Telegram, whose result is saved in the cache
+    file for ttl seconds.
+
+    Parameters
+    ----------
+    path : str, optional
+        The path of the cache file
+    ttl : float, optional
+        How many seconds the cache file is trusted
+
+    Returns
+    -------
+    str
+        The username of the bot, without the @
+    """
+
+    global _username
+    if _username is None:
+        username = _from_settings() or _from_cache(path, ttl)
+        if username is None:
+            username = _from_telegram()
+            _to_cache(path, username)
+        _username = username
+    return _username
+
+
+def set_bot_username(username: Union[str, None]):
+    """Set the username returned by get_bot_username in this process, None
+    to resolve it again on the next call
+
+    Parameters
+    ----------
+    username : str, None
+        The username of the bot, without the @
+    """
+
+    global _username
+    _username = username
@@ -0,0 +1,880 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import gc
+# Needed to pause the garbage collector while compiling
+
+import json
+# Needed to parse the language and callback files
+
+import os
+from os import path as p
+# Needed to build the file paths and read their modification time
+
+import pickle
+# Needed to read and write the language bundle
+
+from glob import glob
+# Needed to find every language file
+
+from contextlib import contextmanager
+# Needed to define _gc_paused
+
+from operator import is_
+# Needed to check if a row of buttons changed
+
+from threading import Lock
+# Needed to avoid parsing the same file twice from concurrent workers
+
+from time import monotonic
+# Needed to throttle the modification time checks
+
+from typing import (Any, Callable, Dict, Iterable, List, NamedTuple, Tuple,
+                    Union)
+# Needed for parameters and return hints
+
+from source.objects.template import Template, compile_template
+# The precompiled message templates
+
+from source.objects.keyboard import Callback, KeyboardTemplate, error_keyboard
+# The precompiled keyboards
+
+
+class StatusEntry(NamedTuple):
+    """Everything a status needs to be rendered in one language.
+
+    A status without buttons has empty buttons and callbacks rows, while
+    callbacks is None if the status is missing from the callback file or
+    its callback rows don't have the same shape of the button rows.
+    """
+    text: Union[Template, None]
+    notify: Union[str, None]
+    buttons: Tuple[Tuple[Template, ...], ...]
+    callbacks: Union[Tuple[Tuple[Callback, ...], ...], None]
+
+
+class _Baker:
+    """Replaces the constants in the templates of many entries, see
+    Template.bake. Every template, button and row without the constants is
+    reused as it is, and every template and keyboard is baked once, so the
+    callback rows shared by the languages are baked only for the first
+    one."""
+
+    def __init__(self, constants: Dict[str, str]):
+        self.constants = constants
+        self._memo: Dict[Template, Template] = dict()
+        self._rows: Dict[int, Tuple[tuple, tuple]] = dict()
+        # id of the rows -> (rows, baked rows), the rows are kept to be
+        # sure their id is not reused
+
+    def template(self, template: Template) -> Template:
+        baked = self._memo.get(template)
+        if baked is None:
+            baked = self._memo[template] = template.bake(self.constants)
+        return baked
+
+    def button(self, button: Callback) -> Callback:
+        callback = button.callback
+        if isinstance(callback, Template):
+            callback = self.template(callback)
+        data = self.template(button.data)
+        if callback is button.callback and data is button.data:
+            return button
+        return button._replace(callback=callback, data=data)
+
+    @staticmethod
+    def _reuse(original: tuple, baked: list) -> tuple:
+        """Get the original tuple if none of its items changed"""
+        if all(map(is_, baked, original)):
+            return original
+        return tuple(baked)
+
+    def rows(self, rows: tuple, bake: Callable) -> tuple:
+        cached = self._rows.get(id(rows))
+        if cached is not None and cached[0] is rows:
+            return cached[1]
+        baked = self._reuse(rows, [self._reuse(row, [bake(item)
+                                                     for item in row])
+                                   for row in rows])
+        self._rows[id(rows)] = (rows, baked)
+        return baked
+
+    def entry(self, entry: StatusEntry) -> StatusEntry:
+        if not self.constants:
+            return entry
+        text = None if entry.text is None else self.template(entry.text)
+        buttons = self.rows(entry.buttons, self.template)
+        callbacks = (None if entry.callbacks is None
+                     else self.rows(entry.callbacks, self.button))
+        if (text is entry.text and buttons is entry.buttons
+                and callbacks is entry.callbacks):
+            return entry
+        return StatusEntry(text, entry.notify, buttons, callbacks)
+
+
+@contextmanager
+def _gc_paused():
+    """Pause the garbage collector while a language is compiled, building
+    many small objects would otherwise trigger a collection every few
+    hundreds of them"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class CategoryEntry(NamedTuple):
+    """A level of a category like role, with its full names already built.
+    The missing values are False."""
+    name: Union[str, bool]
+    emoji: Union[str, bool]
+    emoji_first: Union[str, bool]
+    # "{emoji} {name}", or the one present, or False
+    name_first: Union[str, bool]
+    # "{name} {emoji}", or the one present, or False
+
+
+def _category_entry(level: dict) -> CategoryEntry:
+    """Build the entry of a level of a category"""
+    name = level.get("name") or False
+    emoji = level.get("emoji") or False
+    if name and emoji:
+        return CategoryEntry(name, emoji, f"{emoji} {name}",
+                             f"{name} {emoji}")
+    return CategoryEntry(name, emoji, name or emoji, name or emoji)
+
+
+BUNDLE_PATH = "./data/cache/language.bundle"
+# Where the bundle task saves the compiled languages
+BUNDLE_FORMAT = 1
+# Changed every time the structure of the bundle changes
+
+
+def _get(entry: dict, *keys: str, default=None):
+    """Get the first key present in a json entry, the language files use both
+    the category/state and the category_name/status_name naming"""
+    for key in keys:
+        if key in entry:
+            return entry[key]
+    return default
+
+
+def status_name(category: str, state: str) -> str:
+    """Get the full category@state name of a status
+
+    Parameters
+    ----------
+    category : str
+        The name of the category of the status
+    state : str
+        The name of the status inside its category, it can already be the
+        full name, if it contains the @
+
+    Returns
+    -------
+    str
+        The full name, as passed to CallMess
+    """
+
+    if '@' in state and state.split('@', 1)[0] == category:
+        return state
+    return f"{category}@{state}"
+
+
+def _statuses(json_file: dict, list_keys: Iterable[str]
+              ) -> Iterable[Tuple[str, dict]]:
+    """Iterate over every status of a language or callback file
+
+    Yields
+    ------
+    Tuple[str, dict]
+        The full name of the status and its json entry
+    """
+
+    for category in json_file.get("category", ()):
+        category_name = _get(category, "category_name", "category")
+        for status in _get(category, *list_keys, default=()):
+            yield (status_name(category_name,
+                               _get(status, "status_name", "state")),
+                   status)
+
+
+def _callback_rows(status: dict) -> Tuple[Tuple[Callback, ...], ...]:
+    """Get the callback rows of a callback file status"""
+    return tuple(tuple(Callback(button["type"],
+                                compile_template(button["callback"])
+                                if button["type"] == "url"
+                                else button["callback"],
+                                compile_template(button.get("data", "")))
+                       for button in row)
+                 for row in status.get("buttons") or ())
+
+
+def _shape(rows: Iterable[Iterable[Any]]) -> List[int]:
+    """Get the length of every row of a keyboard"""
+    return [len(row) for row in rows]
+
+
+def build_callbacks(json_callback: dict
+                    ) -> Dict[str, Tuple[Tuple[Callback, ...], ...]]:
+    """Compile the callback rows of every status of the callback file
+
+    Parameters
+    ----------
+    json_callback : dict
+        The parsed callback file
+
+    Returns
+    -------
+    Dict[str, Tuple[Tuple[Callback, ...], ...]]
+        The callback rows, keyed by the full category@state name
+    """
+
+    return {name: _callback_rows(status) for name, status in
+            _statuses(json_callback, ("status", "status_name"))}
+
+
+def build_index(json_lang: dict, json_callback: dict,
+                check_shapes: bool = True,
+                callbacks: Union[Dict[str, Tuple[Tuple[Callback, ...], ...]],
+                                 None] = None) -> Dict[str, StatusEntry]:
+    """Build the status index of a language
+
+    Parameters
+    ----------
+    json_lang : dict
+        The parsed language file
+    json_callback : dict
+        The parsed callback file
+    check_shapes : bool, optional
+        If the callback rows of a status don't have the same shape of its
+        button rows they are discarded, so the error button is shown. It
+        can be disabled if the files were already checked with validate
+    callbacks : Dict[str, Tuple[Tuple[Callback, ...], ...]], None, optional
+        The callback file compiled by build_callbacks, shared between the
+        languages, leave empty to compile it
+
+    Returns
+    -------
+    Dict[str, StatusEntry]
+        Every status of the language, keyed by its full category@state name
+    """
+
+    if callbacks is None:
+        callbacks = build_callbacks(json_callback)
+    index = dict()
+    for name, status in _statuses(json_lang, ("status",)):
+        text = status.get("text")
+        buttons = tuple(tuple(compile_template(button["text"])
+                              for button in row)
+                        for row in status.get("buttons") or ())
+        callback_rows = callbacks.get(name)
+        if (check_shapes and callback_rows and buttons
+                and _shape(buttons) != _shape(callback_rows)):
+            callback_rows = None
+            # The labels can't be matched with their callbacks
+        index[name] = StatusEntry(
+            None if text is None else compile_template(text),
+            status.get("notify"), buttons, callback_rows)
+    return index
+
+
+def validate(json_lang: dict, json_callback: dict) -> List[str]:
+    """Check that every status with buttons has its callbacks, with the same
+    shape of the button rows
+
+    Parameters
+    ----------
+    json_lang : dict
+        The parsed language file
+    json_callback : dict
+        The parsed callback file
+
+    Returns
+    -------
+    List[str]
+        A description of every error found, empty if the files are valid
+    """
+
+    callbacks = {name: status.get("buttons") or () for name, status in
+                 _statuses(json_callback, ("status", "status_name"))}
+    errors = []
+    for name, status in _statuses(json_lang, ("status",)):
+        buttons = status.get("buttons") or ()
+        if not buttons:
+            continue
+        if name not in callbacks:
+            errors.append(f"{name}: the status has buttons but it's not in "
+                          "the callback file")
+        elif callbacks[name] and _shape(buttons) != _shape(callbacks[name]):
+            errors.append(f"{name}: the button rows {_shape(buttons)} don't "
+                          f"match the callback rows {_shape(callbacks[name])}")
+    return errors
+
+
+def _read_json(path: str) -> dict:
+    """Parse a json file"""
+    with open(path, encoding="utf8") as j:
+        return json.load(j)
+
+
+def _read_bundle(path: str) -> Union[dict, None]:
+    """Read a bundle with a single read, None if its format is outdated"""
+    with open(path, "rb") as b, _gc_paused():
+        bundle = pickle.loads(b.read())
+    if not isinstance(bundle, dict) or bundle.get("format") != BUNDLE_FORMAT:
+        return None
+    return bundle
+
+
+def build_bundle(language_dir: str = "./data/language",
+                 callback_path: str = "./data/callback/callback.json"
+                 ) -> Tuple[dict, List[str]]:
+    """Compile every language file and the callback file in a bundle, which
+    LanguageCatalog loads instead of parsing the json files
+
+    Parameters
+    ----------
+    language_dir : str, optional
+        The directory containing the lang{lang}.json files
+    callback_path : str, optional
+        The path of the callback file
+
+    Returns
+    -------
+    Tuple[dict, List[str]]
+        The bundle, and the errors found by validate prefixed by the
+        language. The bundle must not be saved if there are errors
+    """
+
+    json_callback = _read_json(callback_path)
+    callbacks = build_callbacks(json_callback)
+    bundle = {"format": BUNDLE_FORMAT,
+              "callback_mtime": p.getmtime(callback_path),
+              "json_callback": json_callback,
+              "languages": dict()}
+    errors = []
+    for path in sorted(glob(p.join(language_dir, "lang*.json"))):
+        lang = p.basename(path)[len("lang"):-len(".json")]
+        json_lang = _read_json(path)
+        errors.extend(f"[{lang}] {error}"
+                      for error in validate(json_lang, json_callback))
+        bundle["languages"][lang] = {
+            "mtime": p.getmtime(path),
+            "json_lang": json_lang,
+            "statuses": build_index(json_lang, json_callback,
+                                    check_shapes=False, callbacks=callbacks),
+        }
+    return bundle, errors
+
+
+def save_bundle(bundle: dict, path: str = BUNDLE_PATH):
+    """Save a bundle built by build_bundle
+
+    Parameters
+    ----------
+    bundle : dict
+        The bundle
+    path : str, optional
+        Where to save it
+    """
+
+    os.makedirs(p.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "wb") as b:
+        pickle.dump(bundle, b, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+    # The running workers never read a half-written bundle
+
+
+class CompiledLanguage:
+    """A language file ready to be rendered, built once by the catalog
+
+    Attributes
+    ----------
+    lang : str
+        The language
+    json_lang : dict
+        The parsed language file
+    json_callback : dict
+        The parsed callback file
+    statuses : Dict[str, StatusEntry]
+        Every status of the language, keyed by its full category@state name
+    error_msg : Template
+        The text used when a status is not found
+    error_button : str
+        The label of the button used when a status is not found
+    version : tuple
+        The modification times of the files the language was compiled from
+
+    Methods
+    -------
+    keyboard(status: str) -> KeyboardTemplate
+        Get the keyboard of a status
+
+    merge(fallback: CompiledLanguage)
+        Add the statuses missing from this language
+
+    table(category_name: str) -> Tuple[CategoryEntry, ...]
+        Get the levels of a category like role
+    """
+
+    def __init__(self, lang: str, json_lang: dict, json_callback: dict,
+                 statuses: Union[Dict[str, StatusEntry], None] = None,
+                 constants: Union[Dict[str, str], None] = None,
+                 version: tuple = (), baker: Union[_Baker, None] = None):
+        """Initializes the compiled language
+
+        Parameters
+        ----------
+        lang : str
+            The language
+        json_lang : dict
+            The parsed language file
+        json_callback : dict
+            The parsed callback file
+        statuses : Dict[str, StatusEntry], None, optional
+            The status index, as built by build_index, leave empty to build
+            it from the json files
+        constants : Dict[str, str], None, optional
+            The placeholders replaced once in every template, like the bot
+            username
+        version : tuple, optional
+            The modification times of the files
+        baker : _Baker, None, optional
+            Used to replace the constants, shared between the languages of
+            a catalog, leave empty to use a new one
+        """
+
+        if statuses is None:
+            statuses = build_index(json_lang, json_callback)
+        constants = constants or {}
+        self.lang = lang
+        self.json_lang = json_lang
+        self.json_callback = json_callback
+        if baker is None or baker.constants != constants:
+            baker = _Baker(constants)
+        self.statuses = {name: baker.entry(entry)
+                         for name, entry in statuses.items()}
+        self.error_msg = Template.compile(json_lang["error_msg"]).bake(
+            constants)
+        self.error_button = json_lang["error_button"]
+        self.version = version
+        self._keyboards: Dict[str, KeyboardTemplate] = dict()
+        self._error_keyboard = error_keyboard(self.error_button)
+        self._tables: Dict[str, Tuple[CategoryEntry, ...]] = dict()
+        self._fallback: Union[CompiledLanguage, None] = None
+
+    def merge(self, fallback: "CompiledLanguage"):
+        """Add the statuses of the fallback language missing from this one,
+        and the text and the notify missing from its statuses
+
+        Parameters
+        ----------
+        fallback : CompiledLanguage
+            The language used for the missing statuses
+        """
+
+        statuses = dict(fallback.statuses)
+        for name, entry in self.statuses.items():
+            default = statuses.get(name)
+            if default is not None and (entry.text is None
+                                        or entry.notify is None):
+                entry = entry._replace(
+                    text=default.text if entry.text is None else entry.text,
+                    notify=default.notify if entry.notify is None
+                    else entry.notify)
+            statuses[name] = entry
+        self.statuses = statuses
+        self._keyboards.clear()
+        self._tables.clear()
+        self._fallback = fallback
+
+    def table(self, category_name: str) -> Tuple[CategoryEntry, ...]:
+        """Get the levels of a category like role, built on first use and
+        then reused. The levels of the fallback language are used if the
+        category is missing from this one.
+
+        Parameters
+        ----------
+        category_name : str
+            The name of the category in the language file
+
+        Returns
+        -------
+        Tuple[CategoryEntry, ...]
+            The levels, the first one is level 1
+        """
+
+        table = self._tables.get(category_name)
+        if table is None:
+            levels = self.json_lang.get(category_name)
+            if levels is None and self._fallback is not None:
+                return self._fallback.table(category_name)
+            table = tuple(_category_entry(level) for level in levels or ())
+            self._tables[category_name] = table
+        return table
+
+    def keyboard(self, status: str) -> KeyboardTemplate:
+        """Get the keyboard of a status, built on first use and then reused
+
+        Parameters
+        ----------
+        status : str
+            The full name of the status
+
+        Returns
+        -------
+        KeyboardTemplate
+            The keyboard of the status, empty if it has no buttons, or the
+            error keyboard if the status or its callbacks are not found
+        """
+
+        keyboard = self._keyboards.get(status)
+        if keyboard is None:
+            entry = self.statuses.get(status)
+            if entry is None:
+                return self._error_keyboard
+                # Not cached, so unknown statuses can't fill the cache
+            if entry.buttons and entry.callbacks is None:
+                keyboard = self._error_keyboard
+            else:
+                keyboard = KeyboardTemplate(entry.buttons,
+                                            entry.callbacks or ())
+            self._keyboards[status] = keyboard
+        return keyboard
+
+
+class LanguageCatalog:
+    """A process-wide cache of the language files and of the callback file.
+
+    Every file is parsed once and kept in memory. The modification time of
+    the file is checked at most once every check_interval seconds, and the
+    file is parsed again only if it changed, so the translations can be
+    edited without restarting the bot.
+
+    If a bundle built by the bundle task exists, the languages are loaded
+    from it with a single read, unless their json file changed after the
+    bundle was built.
+
+    Every language is merged with the fallback language when it's compiled,
+    so a status missing from a partial translation resolves in one lookup to
+    the fallback one, and a language without a file is the fallback one.
+
+    Attributes
+    ----------
+    language_dir : str
+        The directory containing the lang{lang}.json files
+    callback_path : str
+        The path of the callback file
+    bundle_path : str, None
+        The path of the bundle, None to always use the json files
+    check_interval : float
+        How many seconds to wait before checking again the modification
+        time of an already loaded file
+    constants : Callable[[], Dict[str, str]], None
+        Called when a language is compiled, it returns the placeholders
+        replaced once in every template, like the bot username
+    fallback : str, Callable[[], str], None
+        The language used for the missing languages and statuses, or the
+        function returning it
+
+    Methods
+    -------
+    language(lang: str) -> dict
+        Get the parsed language file of the given language
+
+    compiled(lang: str) -> CompiledLanguage
+        Get the language indexed and ready to be rendered
+
+    clear()
+        Forget every loaded file
+    """
+
+    def __init__(self, language_dir: str = "./data/language",
+                 callback_path: str = "./data/callback/callback.json",
+                 bundle_path: Union[str, None] = BUNDLE_PATH,
+                 check_interval: float = 1.0,
+                 constants: Union[Callable[[], Dict[str, str]], None] = None,
+                 fallback: Union[str, Callable[[], Union[str, None]],
+                                 None] = None):
+        """Initializes an empty catalog, files are loaded on first use
+
+        Parameters
+        ----------
+        language_dir : str, optional
+            The directory containing the lang{lang}.json files
+        callback_path : str, optional
+            The path of the callback file
+        bundle_path : str, None, optional
+            The path of the bundle, None to always use the json files
+        check_interval : float, optional
+            How many seconds to wait between two modification time checks of
+            the same file, 0 to check it on every access
+        constants : Callable[[], Dict[str, str]], None, optional
+            The function returning the placeholders to replace while
+            compiling the templates
+        fallback : str, Callable[[], str], None, optional
+            The language used for the missing languages and statuses, None
+            to not merge the languages. If it's a function it's called on
+            every compilation, so the config is read only when needed
+        """
+
+        self.language_dir = language_dir
+        self.callback_path = callback_path
+        self.bundle_path = bundle_path
+        self.check_interval = check_interval
+        self.constants = constants
+        self.fallback = fallback
+        self._checks: Dict[str, Tuple[Union[float, None], float]] = dict()
+        # path -> (modification time or None if missing, last check)
+        self._files: Dict[str, Tuple[float, Any]] = dict()
+        # path -> (modification time, parsed file)
+        self._compiled: Dict[str, Tuple[tuple, CompiledLanguage]] = dict()
+        # lang -> (modification times of its files, compiled language)
+        self._callbacks: Tuple[Union[dict, None], dict] = (None, dict())
+        # The last parsed callback file and its compiled callback rows
+        self._baker = _Baker({})
+        # Shared by the languages, so they share the baked templates
+        self._lock = Lock()
+
+    def _mtime(self, path: str) -> Union[float, None]:
+        """Get the modification time of a file, checking it at most once
+        every check_interval seconds
+
+        Parameters
+        ----------
+        path : str
+            The path of the file
+
+        Returns
+        -------
+        Union[float, None]
+            The modification time, or None if the file does not exist
+        """
+
+        now = monotonic()
+        checked = self._checks.get(path)
+        if checked is not None and now - checked[1] < self.check_interval:
+            return checked[0]
+            # Checked recently, trust the cached value
+        try:
+            mtime = p.getmtime(path)
+        except OSError:
+            mtime = None
+        self._checks[path] = (mtime, now)
+        return mtime
+
+    def _load(self, path: str,
+              reader: Callable[[str], Any] = _read_json) -> Any:
+        """Get a parsed file, parsing it only if it's not cached or if it
+        changed since the last time
+
+        Parameters
+        ----------
+        path : str
+            The path of the file
+        reader : Callable[[str], Any], optional
+            The function parsing the file, defaults to a json parser
+
+        Returns
+        -------
+        Any
+            The parsed file
+
+        Raises
+        ------
+        FileNotFoundError
+            If the file does not exist
+        """
+
+        mtime = self._mtime(path)
+        if mtime is None:
+            raise FileNotFoundError(path)
+        cached = self._files.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with self._lock:
+            cached = self._files.get(path)
+            if cached is None or cached[0] != mtime:
+                cached = (mtime, reader(path))
+                self._files[path] = cached
+        return cached[1]
+
+    def language_path(self, lang: str) -> str:
+        """Get the path of the language file of the given language
+
+        Parameters
+        ----------
+        lang : str
+            The language
+
+        Returns
+        -------
+        str
+            The path of the lang{lang}.json file
+        """
+
+        return p.join(self.language_dir, f"lang{lang}.json")
+
+    def language(self, lang: str) -> dict:
+        """Get the parsed language file of the given language, or of the
+        fallback language if it doesn't exist. The returned dictionary is
+        shared, it must not be modified.
+
+        Parameters
+        ----------
+        lang : str
+            The language
+
+        Returns
+        -------
+        dict
+            The parsed language file
+
+        Raises
+        ------
+        FileNotFoundError
+            If neither the language nor the fallback one exist
+        """
+
+        return self.compiled(lang).json_lang
+
+    def _from_bundle(self, lang: str, version: tuple
+                     ) -> Union[CompiledLanguage, None]:
+        """Get a language from the bundle, if it's present and its json
+        files didn't change after the bundle was built"""
+        lang_mtime, callback_mtime, bundle_mtime = version
+        if bundle_mtime is None:
+            return None
+        bundle = self._load(self.bundle_path, _read_bundle)
+        if bundle is None or lang not in bundle["languages"]:
+            return None
+        bundled = bundle["languages"][lang]
+        if (lang_mtime not in (None, bundled["mtime"])
+                or callback_mtime not in (None, bundle["callback_mtime"])):
+            return None
+            # Edited after the bundle was built, use the json files
+        return CompiledLanguage(lang, bundled["json_lang"],
+                                bundle["json_callback"], bundled["statuses"],
+                                self._constants(), version, self._baker)
+
+    def _constants(self) -> Dict[str, str]:
+        """Get the constants, the baked templates are forgotten if they
+        changed"""
+        constants = self.constants() if self.constants else {}
+        if constants != self._baker.constants:
+            self._baker = _Baker(constants)
+        return constants
+
+    def _from_json(self, lang: str, version: tuple
+                   ) -> Union[CompiledLanguage, None]:
+        """Compile a language from its json file, None if it doesn't exist.
+        The callback file is compiled once and shared between the
+        languages"""
+        if version[0] is None:
+            return None
+        json_lang = self._load(self.language_path(lang))
+        json_callback = self._load(self.callback_path)
+        if self._callbacks[0] is not json_callback:
+            self._callbacks = (json_callback, build_callbacks(json_callback))
+        return CompiledLanguage(
+            lang, json_lang, json_callback,
+            build_index(json_lang, json_callback,
+                        callbacks=self._callbacks[1]),
+            self._constants(), version, self._baker)
+
+    def compiled(self, lang: Union[str, None] = None) -> CompiledLanguage:
+        """Get the language indexed, merged with the fallback language and
+        ready to be rendered. It's compiled again only if the language file,
+        the fallback language, the callback file or the bundle changed.
+
+        Parameters
+        ----------
+        lang : str, None, optional
+            The language, None for the fallback one
+
+        Returns
+        -------
+        CompiledLanguage
+            The compiled language, or the fallback one if the language is
+            neither in the bundle nor in a json file
+
+        Raises
+        ------
+        FileNotFoundError
+            If neither the language nor the fallback one exist
+        """
+
+        fallback_lang = (self.fallback() if callable(self.fallback)
+                         else self.fallback)
+        if lang is None:
+            lang = fallback_lang
+        fallback = None
+        if fallback_lang is not None and lang != fallback_lang:
+            fallback = self.compiled(fallback_lang)
+        version = (self._mtime(self.language_path(lang)),
+                   self._mtime(self.callback_path),
+                   self._mtime(self.bundle_path) if self.bundle_path
+                   else None)
+        key = version + (fallback.version if fallback else ())
+        cached = self._compiled.get(lang)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        if cached is not None:
+            self._baker = _Baker(self._baker.constants)
+            # A language changed, forget the templates and rows baked for
+            # its old version, so hot reloads don't pile them up
+        with _gc_paused():
+            compiled = (self._from_bundle(lang, version)
+                        or self._from_json(lang, version))
+        if compiled is None:
+            if fallback is None:
+                raise FileNotFoundError(self.language_path(lang))
+            compiled = fallback
+        elif fallback is not None:
+            compiled.merge(fallback)
+        self._compiled[lang] = (key, compiled)
+        return compiled
+
+    def clear(self, path: Union[str, None] = None):
+        """Forget a loaded file, or every loaded file if no path is passed
+
+        Parameters
+        ----------
+        path : str, None, optional
+            The path of the file to forget
+        """
+
+        with self._lock:
+            if path is None:
+                self._files.clear()
+                self._checks.clear()
+            else:
+                self._files.pop(path, None)
+                self._checks.pop(path, None)
+            self._compiled.clear()
+            self._callbacks = (None, dict())
+            self._baker = _Baker({})
@@ -25,6 +25,19 @@ import json
 from os import getenv
 
 
+def _optional(example: dict, prefix: str) -> dict:
+    """Get the keys of a config category from the PREFIX-KEY variables,
+    parsed as json, with the values of the example as defaults"""
+    category = dict()
+    for key, default in example.items():
+        value = getenv(f"{prefix}-{key.upper()}")
+        try:
+            category[key] = json.loads(value) if value else default
+        except ValueError:
+            category[key] = value                 # A string, like a path
+    return category
+
+
 def env_to_json(config_path: str,
                 config_example_path: str = "data/configs/config.json.example"
                 ) -> bool:
@@ -53,6 +66,8 @@ def env_to_json(config_path: str,
     config_json["telegram"]["bot-token"] = getenv("TOKEN-TG", None)
     if config_json["telegram"]["bot-token"] is None:
         return False
+    config_json["telegram"]["bot-username"] = getenv(
+        "BOT-USERNAME", config_example_json["telegram"]["bot-username"])
     config_json["redis"] = dict()
     config_json["redis"]["ip"] = getenv("REDIS-IP",
                                         config_example_json["redis"]["ip"])
@@ -70,6 +85,17 @@ def env_to_json(config_path: str,
     config_json["redis"]["password"] = getenv("REDIS-PASSWORD",
                                               config_example_json["redis"]
                                               ["password"])
+    config_json["redis"] = dict(_optional(config_example_json["redis"],
+                                          "REDIS"), **config_json["redis"])
+    # The optional keys, like the pool and cache settings
+    config_json["storage"] = dict()
+    for key, default in config_example_json["storage"].items():
+        config_json["storage"][key] = getenv(f"STORAGE-{key.upper()}",
+                                             default)
+    config_json["metrics"] = _optional(config_example_json["metrics"],
+                                       "METRICS")
+    config_json["ratelimit"] = _optional(config_example_json["ratelimit"],
+                                         "RATELIMIT")
     # export dict to json file
     with open(config_path, 'w') as config_file:
         json.dump(config_json, config_file, indent=2,
@@ -0,0 +1,182 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+from botogram import Buttons as BButtons
+from botogram.callbacks import ButtonsRow
+# Get the botogram keyboard classes, ButtonsRow builds the button entries
+
+from typing import Iterable, List, NamedTuple, Tuple, Union
+# Needed for parameters and return hints
+
+from source.objects.template import Template
+# The precompiled message templates
+
+
+class Callback(NamedTuple):
+    """A button action as described in the callback file"""
+    type: str
+    # "url" or "callback"
+    callback: Union[Template, str]
+    # The url template or the name of the callback
+    data: Template
+    # The data passed to the callback
+
+
+class _Slot:
+    """A button of a keyboard template. If its label and its url or data
+    have no placeholders the botogram entry is built once and reused."""
+    __slots__ = ("label", "action", "entry")
+
+    def __init__(self, label: Template, action: Callback):
+        self.label = label
+        self.action = action
+        self.entry = None
+        target = action.callback if action.type == "url" else action.data
+        if label.is_static and target.is_static:
+            self.entry = self.render(None, None)
+
+    def render(self, text_button: Union[dict, None],
+               text_data: Union[dict, None]) -> Union[dict, None]:
+        """Build the botogram entry of the button
+
+        Parameters
+        ----------
+        text_button : dict, None
+            The dictionary when key as replaced on a text of the button
+        text_data : dict, None
+            The dictionary when key as replaced on a data
+
+        Returns
+        -------
+        Union[dict, None]
+            The entry of the button, or None if its type is not supported
+        """
+
+        row = ButtonsRow()
+        if self.action.type == "url":
+            row.url(self.label.render(text_button),
+                    self.action.callback.render(text_data))
+        elif self.action.type == "callback":
+            row.callback(self.label.render(text_button),
+                         self.action.callback,
+                         self.action.data.render(text_data))
+        return row._content[0] if row._content else None
+
+
+class KeyboardTemplate:
+    """The keyboard of a status in one language, built once by the catalog.
+
+    The botogram entries of the static buttons are built when the template
+    is created, so applying a fully static keyboard only copies them in the
+    rows of the Buttons object, while the buttons with placeholders are
+    rendered again every time.
+
+    The callback data of botogram is still signed when the message is sent,
+    because it depends on the chat.
+
+    Attributes
+    ----------
+    rows : Tuple[Tuple[_Slot, ...], ...]
+        The buttons of the keyboard
+    is_static : bool
+        True if no button has placeholders
+
+    Methods
+    -------
+    apply(btns: BButtons, text_button: dict = None, text_data: dict = None)
+        Add the keyboard to a botogram Buttons object
+    """
+
+    def __init__(self, labels: Iterable[Iterable[Template]],
+                 callbacks: Iterable[Iterable[Callback]]):
+        """Initializes the keyboard template
+
+        Parameters
+        ----------
+        labels : Iterable[Iterable[Template]]
+            The rows of the labels of the buttons
+        callbacks : Iterable[Iterable[Callback]]
+            The rows of the actions of the buttons, with the same shape of
+            labels
+        """
+
+        self.rows = tuple(tuple(_Slot(label, action)
+                                for label, action in zip(row_labels, row))
+                          for row_labels, row in zip(labels, callbacks))
+        self._static_rows: Tuple[Union[List[dict], None], ...] = tuple(
+            [slot.entry for slot in row if slot.entry is not None]
+            if all(slot.entry is not None
+                   or slot.action.type not in ("url", "callback")
+                   for slot in row) else None
+            for row in self.rows)
+        # The entries of every row without placeholders, None for the others
+        self.is_static = None not in self._static_rows
+
+    def apply(self, btns: BButtons, text_button: Union[dict, None] = None,
+              text_data: Union[dict, None] = None) -> BButtons:
+        """Add the keyboard to a botogram Buttons object, after its last row
+
+        Parameters
+        ----------
+        btns : botogram.Buttons
+            The botogram Buttons class
+        text_button : dict, None, Optional
+            The dictionary when key as replaced on a text of the button
+        text_data : dict, None, Optional
+            The dictionary when key as replaced on a data
+
+        Returns
+        -------
+        botogram.Buttons
+            The same Buttons object, with the keyboard added
+        """
+
+        offset = max(btns._rows) + 1 if btns._rows else 0
+        for index, row in enumerate(self.rows):
+            entries = self._static_rows[index]
+            if entries is None:
+                entries = [slot.entry if slot.entry is not None
+                           else slot.render(text_button, text_data)
+                           for slot in row]
+            btns[offset + index]._content.extend(
+                entry for entry in entries if entry is not None)
+        return btns
+
+
+def error_keyboard(label: str) -> KeyboardTemplate:
+    """Get the keyboard used when a status is not found, a single button
+    that goes back home
+
+    Parameters
+    ----------
+    label : str
+        The label of the button
+
+    Returns
+    -------
+    KeyboardTemplate
+        The keyboard
+    """
+
+    home = Callback("callback", "home", Template("", ()))
+    return KeyboardTemplate(((Template(label, (label,)),),), ((home,),))
@@ -21,24 +21,41 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-import json
-
-from source.objects.config_parser import ConfigParser
-# configuration parser to get telegram info
-
-from botogram import create, Buttons as BButtons
-# Get botogram.create to save the username of the bot and
+from botogram import Buttons as BButtons
 # Get a botogram.Buttons class and save it as BButtons
 
-from typing import Union, List
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Tuple, Union
 # Needed for parameters and return hints
 
+from functools import lru_cache
+# Needed to compile every text passed to text_replace only once
+
+from collections import OrderedDict
+# Needed to keep the most recently rendered broadcast payloads
+
+from source.objects.catalog import CategoryEntry, LanguageCatalog
+# The process-wide cache of the language and callback files
+
+from source.objects.template import Template
+# The precompiled message templates
+
+from source.objects.bot_username import get_bot_username
+# The username of the bot, resolved on first use
+
+from source.objects.redis_connection import setting
+# The preferred language is in the config, read on first use
+
 
-config = ConfigParser("data/configs/config.json")
-bot = create(config.telegram.BOT_TOKEN)
-# todo new config
-bot_username = bot.itself.username
-del bot, create
+def _preferred_language() -> Union[str, None]:
+    """Get the lang-pref key of the telegram config category, like ENG"""
+    lang = setting("lang-pref", category="telegram")
+    return lang.upper() if lang else None
+
+
+catalog = LanguageCatalog(
+    constants=lambda: {"bot_username": get_bot_username()},
+    fallback=_preferred_language)
+# The catalog shared by the whole process
 
 
 class _Category:
@@ -78,20 +95,18 @@ class _Category:
             The lang of the message text
 
         """
-        if lang is None:
-            self.lang = config.telegram.LANGPREF
-            # todo new config
-        else:
-            self.lang = lang
-        try:
-            with open('./data/language/lang' + self.lang + ".json",
-                      encoding="utf8") as j:
-                self.json_lang = json.load(j)
-        except FileNotFoundError:
-            self.lang = config.telegram.LANGPREF
-            with open('./data/language/lang' + self.lang + ".json",
-                      encoding="utf8") as j:
-                self.json_lang = json.load(j)[self.category_name]
+        language = catalog.compiled(lang)
+        # The preferred language if lang is None or doesn't exist
+        self.lang = language.lang
+        self.json_lang = language.json_lang
+        self._levels = language.table(self.category_name)
+        # Shared by every instance with the same language
+
+    def _level(self, level: int) -> Union[CategoryEntry, None]:
+        """Get a level of the category, None if it doesn't exist"""
+        if 0 < level <= len(self._levels):
+            return self._levels[level - 1]
+        return None
 
     def name(self, level: int = 1) -> Union[str, bool]:
         """
@@ -108,10 +123,8 @@ class _Category:
         Union[str,bool]
             The name or False if not found
         """
-        try:
-            return self.jsonlang[level-1]["name"]
-        except (ValueError, IndexError):
-            return False
+        entry = self._level(level)
+        return entry.name if entry is not None else False
 
     def emoji(self, level: int = 1) -> Union[str, bool]:
         """
@@ -128,10 +141,8 @@ class _Category:
         Union[str,bool]
             The emoji or False if not found
         """
-        try:
-            return self.jsonlang[level-1]["emoji"]
-        except (ValueError, IndexError):
-            return False
+        entry = self._level(level)
+        return entry.emoji if entry is not None else False
 
     def name_full(self, level: int = 1, first: bool = True
                   ) -> Union[str, bool]:
@@ -154,22 +165,20 @@ class _Category:
             or one of the two if the other is not present
             or False if not any found
         """
-        name = self.name(level)
-        emoji = self.emoji(level)
-        if name and emoji:
-            if first:
-                return f"{emoji} {name}"
-            else:
-                return f"{name} {emoji}"
-        elif name:
-            return name
-        elif emoji:
-            return emoji
-        else:
+        entry = self._level(level)
+        if entry is None:
             return False
+        return entry.emoji_first if first else entry.name_first
 
 
-def text_replace(text: str, textreplaces: dict = dict()
+@lru_cache(maxsize=1024)
+def _compile(text: str) -> Template:
+    """Compile a text passed to text_replace, with the bot username already
+    replaced"""
+    return Template.compile(text).bake({"bot_username": get_bot_username()})
+
+
+def text_replace(text: str, textreplaces: Union[dict, None] = None
                  ) -> str:
     """
     Replace the key with value in String
@@ -178,7 +187,7 @@ def text_replace(text: str, textreplaces: dict = dict()
     ----------
     text: str
         The string where the words are replaced
-    textreplaces: dict
+    textreplaces: dict, None, Optional
         The dictionary when key as replaced
 
     Returns
@@ -186,15 +195,7 @@ def text_replace(text: str, textreplaces: dict = dict()
     str
         The string with replaced name
     """
-    textreplaces.update({"bot_username": bot_username})
-    try:
-        text = text.format(**textreplaces)
-    except (KeyError, ValueError):
-        # nel caso venga passata una stringa che format non riesce a gestire
-        # viene sostiuita tramite il metodo meno efficente
-        for key, textreplace in textreplaces.items():
-            text = text.replace("{" + key + "}", textreplace)
-    return text
+    return _compile(text).render(textreplaces)
 
 
 class CallMess:
@@ -208,15 +209,17 @@ class CallMess:
         The status of the message
 
     json_lang : dict
-        The json that contiens all message in the language
+        The json that contiens all message in the language, shared with the
+        catalog so it must not be modified
 
     json_callback : dict
-        The json that contiens all callback function
+        The json that contiens all callback function, shared with the catalog
+        so it must not be modified
 
     Methods
     -------
 
-    message(textreplaces: dict = dict())
+    message(textreplaces: dict = None)
         Get the message text based on the status and the language.
 
     callback(btns: BButtons = None, text_button: dict = dict(),
@@ -240,26 +243,16 @@ class CallMess:
             The lang of the message text
 
         """
-        if lang is None:
-            self.lang = config.telegram.LANGPREF
-            # todo new config
-        else:
-            self.lang = lang
         self.status = status
-        try:
-            with open(f"./data/language/lang{self.lang}.json",
-                      encoding="utf8") as j:
-                self.json_lang = json.load(j)
-        except FileNotFoundError:
-            self.lang = config.telegram.LANGPREF
-            # todo new config
-            with open(f"./data/language/lang{self.lang}.json",
-                      encoding="utf8") as j:
-                self.json_lang = json.load(j)
-        with open('./data/callback/callback.json', encoding="utf8") as j:
-            self.json_callback = json.load(j)
-
-    def message(self, textreplaces: dict = dict()) -> str:
+        self._language = catalog.compiled(lang)
+        # The preferred language if lang is None or doesn't exist
+        self.lang = self._language.lang
+        self.json_lang = self._language.json_lang
+        self.json_callback = self._language.json_callback
+        self._entry = self._language.statuses.get(status)
+        # The status index entry, None if the status doesn't exist
+
+    def message(self, textreplaces: Union[dict, None] = None) -> str:
         """Get the message text based on the status and the language.
 
         Parameters
@@ -273,107 +266,10 @@ class CallMess:
             The message text translated
 
         """
-        text = self.json_lang["error_msg"]
-        category_name = self.status.split('@')[0]
-        for category in self.json_lang["category"]:
-            if category["category_name"] == category_name:
-                for status in category["status"]:
-                    if self.status == status["status_name"]:
-                        if 'text' in status:
-                            text = status["text"]
-                            break
-        return text_replace(text, textreplaces)
-
-    def _callback_text(self, text_button: dict
-                       ) -> Union[List[List[str]], bool]:
-        """
-        Internal function to simplify the code
-        return the text of the button or None if not provided
-
-        Parameters
-        ----------
-        text_button : dict
-            The dictionary containing the button text parts to be replaced
-
-        Returns
-        -------
-        Union[List[List[str]], bool]
-            return the array of array of button text or True if buttons is null
-            or False if status don't find
-        """
-        buttons_text = []
-        category_name = self.status.split('@')[0]
-        for category in self.json_lang["category"]:
-            if category["category_name"] == category_name:
-                for status in category["status"]:
-                    if self.status == status["status_name"]:
-                        if status["buttons"] is None:
-                            # if status don't have a button return btns
-                            return True
-                        for row in status["buttons"]:
-                            row_text = []
-                            for buttons in row:
-                                row_text.append(text_replace(
-                                    buttons["text"],
-                                    text_button))
-                            buttons_text.append(row_text)
-                            return buttons_text
-        return False
-
-    def _calback_callback(self, btns: BButtons, xbtns: int,
-                          buttons_text: List[List[str]],
-                          text_data: dict) -> Union[BButtons, None]:
-        """
-        Internal function to simplify the code
-        return the buttons translated
-
-        Parameters
-        ----------
-
-        btns : botogram.Buttons
-            The botogram Buttons class
-        xbtns : int
-            The position to start buttons
-        buttons_text : List[List[str]]
-            the array of array of button text
-        text_data : dict
-            The dictionary when key as replaced on a data
-
-        Returns
-        -------
-        Union[botogram.Buttons, None]
-            The buttons translated or None if status don't find
-        """
-        category_name = self.status.split('@')[0]
-        x, y = 0, 0
-
-        for category in self.json_callback["category"]:
-            if category["category_name"] == category_name:
-                for status in category["status_name"]:
-                    if self.status == status["status_name"]:
-                        if status["buttons"] is None:
-                            return btns
-                        for rows in status["buttons"]:
-                            for button in rows:
-                                if button["type"] == "url":
-                                    btns[xbtns].url(buttons_text[y][x],
-                                                    text_replace(
-                                                        button["callback"],
-                                                        text_data)
-                                                    )
-                                elif button["type"] == "callback":
-                                    btns[xbtns].callback(buttons_text[y][x],
-                                                         button["callback"],
-                                                         text_replace(
-                                                             button["data"],
-                                                             text_data)
-                                                         )
-                                x += 1
-                            x = 0
-                            y += 1
-                            xbtns += 1
-                        return btns
-        return None
+        text = self._language.error_msg
+        if self._entry is not None and self._entry.text is not None:
+            text = self._entry.text
+        return text.render(textreplaces)
 
     def callback(self, btns: BButtons = None,
                  text_button: Union[dict, None] = None,
@@ -384,7 +280,8 @@ class CallMess:
         Parameters
         ----------
         btns : botogram.Buttons, optional
-          The botogram Buttons class
+          The botogram Buttons class, the buttons are added after its last
+          row
           If not specified will be created locally
         text_button : dict, Optional
           The dictionary when key as replaced on a text of the button
@@ -398,28 +295,8 @@ class CallMess:
         """
         if btns is None:
             btns = BButtons()
-        if text_button is None:
-            text_button = dict()
-        if text_data is None:
-            text_data = dict()
-        xbtns = len(btns._rows)
-        if xbtns != 0:
-            xbtns += 1
-        buttons_text = self._callback_text(text_button)
-        if buttons_text is True:
-            return btns
-        elif buttons_text is False:
-            btns[xbtns].callback(self.json_lang["error_button"], 'home')
-            return btns
-
-        btns_new = self._calback_callback(btns, xbtns,
-                                          buttons_text,
-                                          text_data)
-        if btns_new:
-            return btns_new
-        else:
-            btns[xbtns].callback(self.json_lang["error_button"], 'home')
-            return btns
+        return self._language.keyboard(self.status).apply(btns, text_button,
+                                                          text_data)
 
     def notify(self) -> Union[str, None]:
         """
@@ -430,15 +307,88 @@ class CallMess:
         Union[str,None]
             The Value of notify or None if not found
         """
-        category_name = self.status.split('@')[0]
-        for category in self.json_lang["category"]:
-            if category["category"] == category_name:
-                for status in category["status"]:
-                    if self.status == status["status"]:
-                        if "notify" in status:
-                            return status["notify"]
+        if self._entry is None:
+            return None
+        return self._entry.notify
+
+
+class Payload(NamedTuple):
+    """A message ready to be sent, as rendered by render_many"""
+    text: str
+    attach: BButtons
+    notify: Union[str, None]
+
 
+def _user_lang(user: Any) -> Union[str, None]:
+    """Get the language of a user, None to use the preferred one"""
+    return getattr(user, "lang", None)
+
+
+def _render_key(lang: Union[str, None], replaces: Union[dict, None]
+                ) -> Union[tuple, None]:
+    """Get the key of a payload rendered by render_many, None if the
+    replacements can't be hashed, like a list, and the payload must be
+    rendered without caching it"""
+    try:
+        key = (lang, tuple(sorted(replaces.items())) if replaces else ())
+        hash(key)
+    except TypeError:
         return None
+    return key
+
+
+def render_many(status: str,
+                recipients: Iterable[Tuple[Any, Union[dict, None]]],
+                lang_of: Callable[[Any], Union[str, None]] = _user_lang,
+                cache_size: int = 256) -> Iterator[Tuple[Any, Payload]]:
+    """Render the same status for many users, as needed by a broadcast.
+
+    The recipients are consumed lazily and every distinct language and
+    replacements pair is rendered only once while it stays among the
+    cache_size most recently used ones, so the memory used doesn't depend
+    on the number of recipients. The same Payload object is yielded to
+    every user sharing it, it must not be modified.
+
+    Parameters
+    ----------
+    status : str
+        The status of the message
+    recipients : Iterable[Tuple[Any, Union[dict, None]]]
+        The users, each one with the dictionary replaced on the message
+        text, on the button texts and on the button data
+    lang_of : Callable[[Any], Union[str, None]], optional
+        Get the language of a user, by default its lang attribute or the
+        preferred language if it's missing
+    cache_size : int, optional
+        How many rendered payloads are kept
+
+    Yields
+    ------
+    Tuple[Any, Payload]
+        Every user, in the same order, with its payload
+    """
+
+    messages = dict()
+    # lang -> CallMess, the languages are few so they are all kept
+    rendered: OrderedDict = OrderedDict()
+    for user, replaces in recipients:
+        lang = lang_of(user)
+        key = _render_key(lang, replaces)
+        payload = rendered.get(key) if key is not None else None
+        if payload is None:
+            message = messages.get(lang)
+            if message is None:
+                message = messages[lang] = CallMess(status, lang)
+            payload = Payload(message.message(replaces),
+                              message.callback(None, replaces, replaces),
+                              message.notify())
+            if key is not None:
+                rendered[key] = payload
+                if len(rendered) > cache_size:
+                    rendered.popitem(last=False)
+        else:
+            rendered.move_to_end(key)
+        yield user, payload
 
 
 class Role(_Category):
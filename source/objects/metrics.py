@@ -0,0 +1,340 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import redis
+# Required to work with redis
+
+from redis import asyncio
+# The asyncio clients are instrumented as well
+
+from bisect import bisect_left
+# Needed to find the bucket of a latency
+
+from contextlib import contextmanager
+# Needed to define _timed
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+# Serves the metrics to Prometheus
+
+import os
+# Every worker process serves its own metrics
+
+from threading import Lock, Thread
+# The commands are recorded by many threads
+
+from time import perf_counter
+# Needed to time the commands
+
+from typing import Dict, List, Tuple, Union
+# Needed for parameters and return hints
+
+from source.objects.redis_connection import setting
+# The metrics are configured in the metrics config category
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5)
+# The upper bounds, in seconds, of the latency histogram buckets
+
+
+class CommandMetrics:
+    """The latency histogram, the calls and the errors of every redis
+    command, in the Prometheus text format. A pipeline is a single command,
+    named after the commands in it, like PIPELINE HSET+PUBLISH.
+
+    Methods
+    -------
+    observe(command: str, seconds: float, error: str = None)
+        Record a command
+    render()
+        Get the metrics in the Prometheus text format
+    clear()
+        Forget every command recorded
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        """
+        Parameters
+        ----------
+        buckets : Tuple[float, ...], optional
+            The upper bounds of the buckets, in seconds, sorted
+        """
+        self.buckets = buckets
+        self._latency: Dict[str, List[float]] = dict()
+        self._errors: Dict[Tuple[str, str], int] = dict()
+        self._lock = Lock()
+
+    def observe(self, command: str, seconds: float,
+                error: Union[str, None] = None):
+        """Record a command
+
+        Parameters
+        ----------
+        command : str
+            The name of the command, like HMGET
+        seconds : float
+            How long it took
+        error : str, optional
+            The name of the exception raised, if any
+        """
+        with self._lock:
+            latency = self._latency.get(command)
+            if latency is None:
+                latency = self._latency[command] = [0] * (
+                    len(self.buckets) + 2)
+                # The calls in every bucket, the sum and the count
+            index = bisect_left(self.buckets, seconds)
+            if index < len(self.buckets):
+                latency[index] += 1      # Slower ones are only in +Inf
+            latency[-2] += seconds
+            latency[-1] += 1
+            if error is not None:
+                key = (command, error)
+                self._errors[key] = self._errors.get(key, 0) + 1
+
+    def render(self) -> str:
+        """Get the metrics in the Prometheus text format
+
+        Returns
+        -------
+        str
+            The redis_command_duration_seconds histogram and the
+            redis_command_errors_total counter
+        """
+        with self._lock:
+            latency = {command: list(values)
+                       for command, values in self._latency.items()}
+            errors = dict(self._errors)
+        lines = ["# HELP redis_command_duration_seconds The latency of the "
+                 "redis commands of the users",
+                 "# TYPE redis_command_duration_seconds histogram"]
+        for command, values in sorted(latency.items()):
+            total = 0
+            for bound, calls in zip(self.buckets, values):
+                total += calls
+                lines.append(f'redis_command_duration_seconds_bucket{{'
+                             f'command="{command}",le="{bound}"}} {total}')
+            lines.append(f'redis_command_duration_seconds_bucket{{'
+                         f'command="{command}",le="+Inf"}} {values[-1]}')
+            lines.append(f'redis_command_duration_seconds_sum{{'
+                         f'command="{command}"}} {values[-2]}')
+            lines.append(f'redis_command_duration_seconds_count{{'
+                         f'command="{command}"}} {values[-1]}')
+        lines += ["# HELP redis_command_errors_total The redis commands of "
+                  "the users that raised an error",
+                  "# TYPE redis_command_errors_total counter"]
+        for (command, error), calls in sorted(errors.items()):
+            lines.append(f'redis_command_errors_total{{command="{command}",'
+                         f'error="{error}"}} {calls}')
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        """Forget every command recorded"""
+        with self._lock:
+            self._latency.clear()
+            self._errors.clear()
+
+
+METRICS = CommandMetrics()
+# Where the instrumented clients record their commands
+
+
+def _name(args: tuple) -> str:
+    """Get the name of a command from its arguments"""
+    name = args[0]
+    return (name.decode() if isinstance(name, bytes) else str(name)).upper()
+
+
+def _pipeline_name(command_stack: list) -> str:
+    """Get the name of a pipeline, every command once, in order"""
+    return "PIPELINE " + "+".join(dict.fromkeys(
+        _name(args) for args, _ in command_stack))
+
+
+@contextmanager
+def _timed(command: str):
+    """Record in METRICS how long the block takes and its exception"""
+    start, error = perf_counter(), None
+    try:
+        yield
+    except Exception as exception:
+        error = type(exception).__name__
+        raise
+    finally:
+        METRICS.observe(command, perf_counter() - start, error)
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    """A pipeline recording its execution in METRICS"""
+
+    def execute(self, raise_on_error: bool = True) -> list:
+        if not self.command_stack:
+            return super().execute(raise_on_error)
+        with _timed(_pipeline_name(self.command_stack)):
+            return super().execute(raise_on_error)
+
+
+class InstrumentedRedis(redis.Redis):
+    """A redis client recording every command and pipeline in METRICS"""
+
+    def execute_command(self, *args, **options):
+        with _timed(_name(args)):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None
+                 ) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool,
+                                    self.response_callbacks, transaction,
+                                    shard_hint)
+
+
+class InstrumentedAsyncPipeline(asyncio.client.Pipeline):
+    """An asyncio pipeline recording its execution in METRICS"""
+
+    async def execute(self, raise_on_error: bool = True) -> list:
+        if not self.command_stack:
+            return await super().execute(raise_on_error)
+        with _timed(_pipeline_name(self.command_stack)):
+            return await super().execute(raise_on_error)
+
+
+class InstrumentedAsyncRedis(asyncio.Redis):
+    """An asyncio redis client recording every command and pipeline in
+    METRICS, like InstrumentedRedis"""
+
+    async def execute_command(self, *args, **options):
+        with _timed(_name(args)):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None
+                 ) -> InstrumentedAsyncPipeline:
+        return InstrumentedAsyncPipeline(self.connection_pool,
+                                         self.response_callbacks,
+                                         transaction, shard_hint)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serves METRICS on /metrics"""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = METRICS.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type",
+                         "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Don't log every scrape"""
+
+
+def serve(host: str = "127.0.0.1", port: int = 9100) -> ThreadingHTTPServer:
+    """Serve METRICS on http://host:port/metrics, in a daemon thread
+
+    Parameters
+    ----------
+    host : str, optional
+        The address listened on
+    port : int, optional
+        The port listened on, 0 for any free one
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        The running server, shutdown() stops it
+    """
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True,
+           name="metrics-server").start()
+    return server
+
+
+_server: Union[ThreadingHTTPServer, None] = None
+_server_pid: Union[int, None] = None
+# The process that started _server, a forked worker must start its own
+_lock = Lock()
+
+
+def start() -> Union[ThreadingHTTPServer, None]:
+    """Serve METRICS in this process, if not already served, on the first
+    free port among the ports ones starting from port, keys of the metrics
+    config category.
+
+    The metrics are recorded per process: every botogram worker serves its
+    own ones on its own port, so with the default 2 workers the ports port
+    and port + 1 are used. Prometheus must scrape all of them, the series
+    of the whole bot being the sum by instance. If no port is free the
+    commands are still recorded, but not served, and the redis clients
+    keep working.
+
+    Returns
+    -------
+    ThreadingHTTPServer, None
+        The server of this process, None if no port was free
+    """
+
+    global _server, _server_pid
+    with _lock:
+        if _server_pid != os.getpid():
+            if _server_pid is not None:
+                METRICS.clear()         # Recorded by the parent process
+            _server_pid = os.getpid()
+            _server = None
+            host = setting("host", "127.0.0.1", "metrics")
+            port = int(setting("port", 9100, "metrics"))
+            for offset in range(max(int(setting("ports", 4, "metrics")), 1)):
+                try:
+                    _server = serve(host, port + offset)
+                    break
+                except OSError:
+                    continue            # Taken by another worker
+        return _server
+
+
+def client_class(module=redis) -> type:
+    """Get the class of the redis clients of the users: InstrumentedRedis,
+    with the endpoint of this process started, see start, if the enabled
+    key of the metrics config category is set, redis.Redis otherwise, so
+    the metrics cost nothing when disabled
+
+    Parameters
+    ----------
+    module : module, optional
+        redis, or redis.asyncio for the asyncio clients
+
+    Returns
+    -------
+    type
+        The class of the clients
+    """
+
+    if not setting("enabled", False, "metrics"):
+        return module.Redis
+    start()
+    return InstrumentedAsyncRedis if module is asyncio else InstrumentedRedis
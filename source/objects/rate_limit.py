@@ -0,0 +1,206 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import redis
+# Required to work with redis
+
+from collections import OrderedDict
+# The throttled users are forgotten from the oldest one
+
+from threading import Lock
+# The updates are handled by many threads
+
+from time import monotonic, time
+# Needed to refill the buckets and to expire the throttled users
+
+from typing import Dict, Tuple, Union
+# Needed for parameters and return hints
+
+from source.objects.redis_connection import LazyScript, setting
+# The buckets are kept on redis, the limits are in the config
+
+UPDATE_TYPES = ("message", "callback", "inline")
+# The update types that can be limited, keys of the ratelimit category
+
+TAKE = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local last = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - last) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 't', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return wait
+"""
+# Take a token from the bucket KEYS[1], refilled with ARGV[1] tokens per
+# second up to ARGV[2] tokens, at ARGV[3] seconds. Returns 0 if taken or
+# the milliseconds until the next one. A full bucket expires, like a bucket
+# never used
+
+_take = LazyScript(TAKE)
+
+
+def parse_limit(value: Union[str, None]) -> Union[Tuple[int, float], None]:
+    """Parse a limit of the ratelimit config category
+
+    Parameters
+    ----------
+    value : str, None
+        The limit, like 20/60 for 20 updates every 60 seconds, also in a
+        burst
+
+    Returns
+    -------
+    Union[Tuple[int, float], None]
+        The updates and the seconds, None if the value is not set
+
+    Raises
+    ------
+    ValueError
+        If the limit is not like 20/60 or it's not positive
+    """
+
+    if not value:
+        return None
+    updates, _, seconds = str(value).partition("/")
+    limit = (int(updates), float(seconds or 1))
+    if min(limit) <= 0:
+        raise ValueError(f"The limit {value} must be positive")
+    return limit
+
+
+class RateLimiter:
+    """A token bucket for every user and update type, kept on redis so it's
+    shared by every process and taken with a single script call. Check it
+    before getting the User, so a flooding user costs a single round-trip.
+
+    The users throttled are remembered in the process until they get a new
+    token, so their next updates are rejected without going to redis.
+
+    Attributes
+    ----------
+    limits : Dict[str, Tuple[int, float]]
+        The updates allowed every some seconds, by update type
+
+    Methods
+    -------
+    allow(user_id: int, update_type: str = "message")
+        Take a token for an update of a user
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[int, float]],
+                 max_throttled: int = 10000):
+        """
+        Parameters
+        ----------
+        limits : Dict[str, Tuple[int, float]]
+            The updates allowed every some seconds, by update type, the
+            update types missing are not limited
+        max_throttled : int, optional
+            How many throttled users are remembered at most, the ones
+            throttled first are forgotten and checked on redis again
+        """
+        self.limits = limits
+        self.max_throttled = max_throttled
+        self._throttled: "OrderedDict[Tuple[str, int], float]" = OrderedDict()
+        # (update type, user id) -> until when its updates are rejected, in
+        # the order they were throttled
+        self._lock = Lock()
+
+    def allow(self, user_id: int, update_type: str = "message") -> bool:
+        """Take a token for an update of a user. If redis can't be reached
+        the update is allowed, the bot keeps working without the limits
+
+        Parameters
+        ----------
+        user_id : int
+            The Telegram ID of the user
+        update_type : str, optional
+            The type of the update, one of UPDATE_TYPES
+
+        Returns
+        -------
+        bool
+            False if the update must be dropped
+        """
+
+        limit = self.limits.get(update_type)
+        if limit is None:
+            return True
+        until = self._throttled.get((update_type, user_id))
+        if until is not None and until > monotonic():
+            return False                 # Still throttled, redis not needed
+
+        updates, seconds = limit
+        try:
+            wait = _take(keys=[f"ratelimit:{update_type}:{user_id}"],
+                         args=[updates / seconds, updates, time()])
+        except redis.RedisError:
+            return True
+        if wait:
+            self._throttle((update_type, user_id), wait / 1000)
+        return not wait
+
+    def _throttle(self, key: Tuple[str, int], seconds: float):
+        """Reject the updates of a user for some seconds without redis"""
+        now = monotonic()
+        with self._lock:
+            self._throttled[key] = now + seconds
+            self._throttled.move_to_end(key)
+            while self._throttled and (
+                    len(self._throttled) > self.max_throttled
+                    or next(iter(self._throttled.values())) <= now):
+                self._throttled.popitem(last=False)  # Expired or the oldest
+
+
+_limiter: Union[RateLimiter, None] = None
+
+
+def get_limiter() -> RateLimiter:
+    """Get the rate limiter of the process, created on the first call from
+    the keys of the ratelimit config category, one for every update type,
+    like "message": "20/60", null to not limit it
+
+    Returns
+    -------
+    RateLimiter
+        The shared limiter
+    """
+
+    global _limiter
+    if _limiter is None:
+        limits = {update_type: parse_limit(setting(update_type, None,
+                                                   "ratelimit"))
+                  for update_type in UPDATE_TYPES}
+        _limiter = RateLimiter({update_type: limit for update_type, limit
+                                in limits.items() if limit is not None})
+    return _limiter
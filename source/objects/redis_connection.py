@@ -0,0 +1,339 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import redis
+# Required to work with redis
+
+from threading import Lock
+# Two threads must not build two pools
+
+from source.objects.config_parser import Config
+# The config file, read on the first use
+
+from typing import Any, Dict, List, Union
+# Needed for parameters and return hints
+
+CONFIG_PATH = "data/configs/config.json"
+
+_config = None
+_client: Union[redis.Redis, None] = None
+_async_client = None
+_nodes: Union[Dict[str, redis.Redis], None] = None
+_replicas: Union[List[redis.Redis], None] = None
+_lock = Lock()
+
+
+def setting(key: str, default: Any = None, category: str = "redis") -> Any:
+    """Get a key of a config category, the config file is read on the first
+    call. A missing config file is like an empty one
+
+    Parameters
+    ----------
+    key : str
+        The name of the key as written in the config file, like
+        max-connections
+    default : Any, optional
+        Returned if the key or the category is not set or is null
+    category : str, optional
+        The config category, redis by default
+
+    Returns
+    -------
+    Any
+        The value of the key, the nested categories as a dict or a list
+    """
+
+    global _config
+    if _config is None:
+        _config = Config(path=CONFIG_PATH)
+    value = getattr(getattr(_config, category, None), key, None)
+    if hasattr(value, "as_dict"):
+        value = value.as_dict()     # A nested category, like the nodes
+    return default if value is None or value == "" else value
+
+
+def _number(key: str, type_of_return: type = float
+            ) -> Union[int, float, None]:
+    """Get a numeric key of the redis config category, None if not set"""
+    value = setting(key)
+    return type_of_return(value) if value is not None else None
+
+
+def pool_kwargs(module: Any = redis) -> Dict[str, Any]:
+    """Build the connection pool arguments from the redis config category.
+    Besides ip, port, database and password, the optional keys are:
+
+    unix-socket : str
+        The path of the redis unix socket, used instead of ip and port
+    max-connections : int
+        The maximum number of connections opened by this process
+    blocking-pool : bool
+        Wait for a free connection, up to pool-timeout seconds, instead of
+        raising an error when max-connections are in use
+    connect-timeout, socket-timeout : float
+        The seconds to wait for the connection and for every reply
+    keepalive : bool
+        Enable TCP keepalive on the connections
+    health-check-interval : int
+        Ping a connection idle for this many seconds before using it
+
+    Parameters
+    ----------
+    module : module, optional
+        Where the connection classes are taken from, redis or redis.asyncio
+
+    Returns
+    -------
+    Dict[str, Any]
+        The keyword arguments of redis.ConnectionPool
+    """
+
+    kwargs = {"db": int(setting("database", 0)),
+              "password": setting("password"),
+              "socket_timeout": _number("socket-timeout"),
+              "health_check_interval": _number("health-check-interval",
+                                               int) or 0,
+              "decode_responses": True}
+    if setting("max-connections") is not None:
+        kwargs["max_connections"] = _number("max-connections", int)
+    socket = setting("unix-socket")
+    if socket:
+        kwargs.update(connection_class=module.UnixDomainSocketConnection,
+                      path=socket)
+    else:
+        kwargs.update(host=setting("ip", "localhost"),
+                      port=int(setting("port", 6379)),
+                      socket_connect_timeout=_number("connect-timeout"),
+                      socket_keepalive=bool(setting("keepalive", False)))
+    if setting("blocking-pool", False):
+        kwargs["timeout"] = _number("pool-timeout") or 20
+    return kwargs
+
+
+def get_redis() -> redis.Redis:
+    """Get the redis client shared by the whole process, created on the
+    first call. No connection is opened until the first command. Its
+    commands are recorded if the metrics config category enables them.
+
+    Returns
+    -------
+    redis.Redis
+        The shared client
+    """
+
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                kwargs = pool_kwargs()
+                pool_class = (redis.BlockingConnectionPool if "timeout"
+                              in kwargs else redis.ConnectionPool)
+                _client = _client_class()(
+                    connection_pool=pool_class(**kwargs))
+    return _client
+
+
+def get_async_redis():
+    """Get the asyncio redis client shared by the whole process, created on
+    the first call with the same settings as get_redis, its commands recorded
+    as well when the metrics are enabled. It must be used by a single event
+    loop.
+
+    Returns
+    -------
+    redis.asyncio.Redis
+        The shared asyncio client
+    """
+
+    global _async_client
+    if _async_client is None:
+        from redis import asyncio
+        # Imported here since only the async code needs it
+
+        with _lock:
+            if _async_client is None:
+                kwargs = pool_kwargs(asyncio)
+                pool_class = (asyncio.BlockingConnectionPool if "timeout"
+                              in kwargs else asyncio.ConnectionPool)
+                _async_client = _client_class(asyncio)(
+                    connection_pool=pool_class(**kwargs))
+    return _async_client
+
+
+def _client_class(module: Any = redis) -> type:
+    """Get the class of the clients of redis or redis.asyncio, instrumented
+    if the metrics are enabled"""
+    from source.objects.metrics import client_class
+    # Imported here since the metrics read the config with setting
+
+    return client_class(module)
+
+
+def _from_urls(urls: Dict[str, str]) -> Dict[str, redis.Redis]:
+    """Build a client for every redis URL, by name, with the pool settings
+    of get_redis, except where to connect"""
+    client_class = _client_class()
+    kwargs = {key: value for key, value in pool_kwargs().items()
+              if key not in ("db", "password", "host", "port", "path",
+                             "connection_class")}
+    pool_class = (redis.BlockingConnectionPool if "timeout" in kwargs
+                  else redis.ConnectionPool)
+    return {name: client_class(connection_pool=pool_class.from_url(url,
+                                                                   **kwargs))
+            for name, url in urls.items()}
+
+
+def get_nodes() -> Dict[str, redis.Redis]:
+    """Get a client for every node of the nodes key of the redis config
+    category, redis URLs like redis://:password@host:6379/0 by a name, like
+    {"a": "redis://..."}, where the users are sharded. The users are placed
+    by name, so a URL can change without moving them. The clients are
+    created on the first call with the pool settings of get_redis.
+
+    Returns
+    -------
+    Dict[str, redis.Redis]
+        The clients by name, empty if the users are not sharded
+    """
+
+    global _nodes
+    if _nodes is None:
+        with _lock:
+            if _nodes is None:
+                _nodes = _from_urls(dict(setting("nodes", {})))
+    return _nodes
+
+
+def set_nodes(nodes: Union[Dict[str, redis.Redis], None]):
+    """Set the clients returned by get_nodes, None to build them again from
+    the config on the next call
+
+    Parameters
+    ----------
+    nodes : Dict[str, redis.Redis], None
+        The new clients, by name
+    """
+
+    global _nodes
+    with _lock:
+        _nodes = nodes
+
+
+def get_replicas() -> List[redis.Redis]:
+    """Get a client for every replica of the replicas key of the redis
+    config category, a list of redis URLs, where the users can be read.
+    They're created on the first call with the pool settings of get_redis.
+
+    Returns
+    -------
+    List[redis.Redis]
+        The clients, empty if every read goes to the primary
+    """
+
+    global _replicas
+    if _replicas is None:
+        with _lock:
+            if _replicas is None:
+                _replicas = list(_from_urls({
+                    url: url for url in setting("replicas", [])}).values())
+    return _replicas
+
+
+def set_replicas(replicas: Union[List[redis.Redis], None]):
+    """Set the clients returned by get_replicas, None to build them again
+    from the config on the next call
+
+    Parameters
+    ----------
+    replicas : List[redis.Redis], None
+        The new clients
+    """
+
+    global _replicas
+    with _lock:
+        _replicas = replicas
+
+
+def set_redis(client: Union[redis.Redis, None], async_client: Any = None):
+    """Set the clients returned by get_redis and get_async_redis, None to
+    build them again from the config on the next call
+
+    Parameters
+    ----------
+    client : redis.Redis, None
+        The new shared client
+    async_client : redis.asyncio.Redis, None, optional
+        The new shared asyncio client
+    """
+
+    global _client, _async_client
+    with _lock:
+        _client = client
+        _async_client = async_client
+
+
+class LazyScript:
+    """A Lua script registered on the shared client on its first call, so it
+    can be declared at import time
+
+    Methods
+    -------
+    __call__(keys: List = None, args: List = None, client=None)
+        Run the script with EVALSHA, loading it if needed
+    """
+
+    def __init__(self, source: str):
+        """
+        Parameters
+        ----------
+        source : str
+            The Lua source of the script
+        """
+        self.source = source
+        self._script = None
+        self._client = None
+
+    def __call__(self, keys: Union[List, None] = None,
+                 args: Union[List, None] = None, client=None) -> Any:
+        """Run the script
+
+        Parameters
+        ----------
+        keys : List, optional
+            The KEYS of the script
+        args : List, optional
+            The ARGV of the script
+        client : redis.Redis, redis.client.Pipeline, optional
+            Where to run the script, the shared client by default
+
+        Returns
+        -------
+        Any
+            The reply of the script
+        """
+        shared = get_redis()
+        if self._script is None or self._client is not shared:
+            self._script = shared.register_script(self.source)
+            self._client = shared
+        return self._script(keys=keys, args=args, client=client)
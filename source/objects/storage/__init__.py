@@ -0,0 +1,90 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from typing import Union
+# Needed for parameters and return hints
+
+from source.objects.redis_connection import get_nodes, setting
+# The storage is chosen in the storage config category
+
+from source.objects.storage.base import UserStorage
+from source.objects.storage.memory import MemoryStorage
+from source.objects.storage.redis_storage import RedisStorage
+from source.objects.storage.sharded import HashRing, ShardedRedisStorage
+from source.objects.storage.sqlite import SQLiteStorage
+
+__all__ = ["HashRing", "MemoryStorage", "RedisStorage", "SQLiteStorage",
+           "ShardedRedisStorage", "UserStorage", "get_storage", "set_storage"]
+
+_storage: Union[UserStorage, None] = None
+
+
+def get_storage() -> UserStorage:
+    """Get the storage of the users, created on the first call from the
+    backend key of the storage config category: redis (the default),
+    sharded on the nodes key of the redis config category if it's set,
+    else reading from its replicas key if it's set,
+    sqlite, with the database at sqlite-path, or memory
+
+    Returns
+    -------
+    UserStorage
+        The storage shared by the whole process
+
+    Raises
+    ------
+    ValueError
+        If the backend is not known
+    """
+
+    global _storage
+    if _storage is None:
+        backend = setting("backend", "redis", "storage")
+        if backend == "redis" and get_nodes():
+            _storage = ShardedRedisStorage(get_nodes())
+        elif backend == "redis":
+            _storage = RedisStorage(float(setting("replica-pin-time", 1)))
+        elif backend == "sqlite":
+            _storage = SQLiteStorage(setting("sqlite-path",
+                                             "./data/users.sqlite3",
+                                             "storage"))
+        elif backend == "memory":
+            _storage = MemoryStorage()
+        else:
+            raise ValueError(f"Unknown storage backend {backend}")
+    return _storage
+
+
+def set_storage(storage: Union[UserStorage, None]):
+    """Set the storage returned by get_storage, None to create it again from
+    the config on the next call
+
+    Parameters
+    ----------
+    storage : UserStorage, None
+        The new storage
+    """
+
+    global _storage
+    _storage = storage
@@ -0,0 +1,228 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from abc import ABC, abstractmethod
+# A backend missing a method can't be instantiated
+
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+# Needed for parameters and return hints
+
+
+class UserStorage(ABC):
+    """Where the users are saved. User works with any implementation of
+    this interface, every method except listen must be implemented.
+
+    Every user is a dict of str fields, with the full names used by User:
+    id, first_name, last_name, username, last_activity and state. The
+    values passed to the methods can be of any type and are saved as str.
+
+    The reads of a single user and of many users may be served by replicas
+    lagging behind the writes, unless they're asked to be consistent.
+
+    Methods
+    -------
+    listen(cache: UserCache)
+        Keep a user cache consistent with the other processes
+    head(user_id: int, consistent: bool = False)
+        Get the id and the state of a user
+    load(user_id: int, consistent: bool = False)
+        Get every field of a user
+    fields(user_id: int, names: Iterable[str], consistent: bool = False)
+        Get some fields of a user
+    create(fields: dict)
+        Save a new user, unless it already exists
+    set_fields(user_id: int, fields: dict, cache: UserCache = None)
+        Change some fields of a user
+    transition(user_id: int, new_state: str, expected: str = None,
+               cache: UserCache = None)
+        Change the state of a user if it's the expected one
+    count_state(state: str)
+        Count the users in a state
+    many(user_ids: Iterable[int], chunk_size: int = 500,
+         consistent: bool = False)
+        Get many users at once
+    scan(count: int = 1000)
+        Walk every user
+    touch(activity: Dict[int, float])
+        Save the last activity of many users at once
+    count_active(since: float)
+        Count the users active since a time
+    active_since(since: float, start: int = 0, num: int = None)
+        Get the ids of the users active since a time
+    """
+
+    def listen(self, cache) -> bool:
+        """Keep a user cache consistent with the writes of the other
+        processes
+
+        Parameters
+        ----------
+        cache : UserCache
+            The cache of this process
+
+        Returns
+        -------
+        bool
+            False if the storage can't tell when the other processes write,
+            so the cache must not be used
+        """
+        return False
+
+    @abstractmethod
+    def head(self, user_id: int, consistent: bool = False
+             ) -> Dict[str, str]:
+        """Get the id and the state of a user, empty if not present. A
+        consistent read sees every write already done"""
+
+    @abstractmethod
+    def load(self, user_id: int, consistent: bool = False
+             ) -> Dict[str, str]:
+        """Get every field of a user, empty if not present. A consistent
+        read sees every write already done"""
+
+    @abstractmethod
+    def fields(self, user_id: int, names: Iterable[str],
+               consistent: bool = False) -> Dict[str, Union[str, None]]:
+        """Get some fields of a user, None if not present. A consistent read
+        sees every write already done"""
+
+    @abstractmethod
+    def create(self, fields: dict) -> Dict[str, str]:
+        """Save a new user, atomically, unless it already exists
+
+        Parameters
+        ----------
+        fields : dict
+            Every field of the user, as returned by new_user
+
+        Returns
+        -------
+        Dict[str, str]
+            The fields of the existing user, empty if the user was created
+        """
+
+    @abstractmethod
+    def set_fields(self, user_id: int, fields: dict, cache=None) -> int:
+        """Change some fields of a user, except the state
+
+        Parameters
+        ----------
+        user_id : int
+            The Telegram ID of the user
+        fields : dict
+            The fields to change
+        cache : UserCache, optional
+            The cache to invalidate in the other processes
+
+        Returns
+        -------
+        int
+            How many fields were added
+        """
+
+    @abstractmethod
+    def transition(self, user_id: int, new_state: str,
+                   expected: Union[str, None] = None, cache=None
+                   ) -> Tuple[int, str]:
+        """Change the state of a user, atomically, if it's the expected one
+
+        Parameters
+        ----------
+        user_id : int
+            The Telegram ID of the user
+        new_state : str
+            The new state
+        expected : str, None, optional
+            Change the state only if the current one is this, whatever it
+            is if None
+        cache : UserCache, optional
+            The cache to invalidate in the other processes
+
+        Returns
+        -------
+        Tuple[int, str]
+            1 if changed, 0 if the state wasn't the expected one or -1 if
+            the user doesn't exist, and the previous state
+        """
+
+    @abstractmethod
+    def count_state(self, state: str) -> int:
+        """Count the users in a state"""
+
+    @abstractmethod
+    def many(self, user_ids: Iterable[int], chunk_size: int = 500,
+             consistent: bool = False) -> Iterator[Dict[str, str]]:
+        """Get many users at once, reading chunk_size users at a time. A
+        consistent read sees every write already done
+
+        Yields
+        ------
+        Dict[str, str]
+            Every user, in the same order of user_ids, empty if not present
+        """
+
+    @abstractmethod
+    def scan(self, count: int = 1000) -> Iterator[Dict[str, str]]:
+        """Walk every user, reading count users at a time
+
+        Yields
+        ------
+        Dict[str, str]
+            Every user, in no particular order
+        """
+
+    @abstractmethod
+    def touch(self, activity: Dict[int, float]):
+        """Save the last activity of many users at once
+
+        Parameters
+        ----------
+        activity : Dict[int, float]
+            The last activity of every user, by Telegram ID
+        """
+
+    @abstractmethod
+    def count_active(self, since: float) -> int:
+        """Count the users active since a time"""
+
+    @abstractmethod
+    def active_since(self, since: float, start: int = 0,
+                     num: Union[int, None] = None) -> List[int]:
+        """Get the ids of the users active since a time, the least recently
+        active first
+
+        Parameters
+        ----------
+        since : float
+            The oldest activity returned
+        start : int, optional
+            How many users are skipped, to read the users in pages
+        num : int, optional
+            How many users are returned, all by default
+
+        Returns
+        -------
+        List[int]
+            The Telegram IDs of the users
+        """
@@ -0,0 +1,133 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from collections import defaultdict
+# Needed to index the users by state
+
+from threading import Lock
+# The activity tracker writes from its own thread
+
+from typing import Dict, Iterable, Iterator, List, Set, Tuple, Union
+# Needed for parameters and return hints
+
+from source.objects.storage.base import UserStorage
+# The interface implemented
+
+
+class MemoryStorage(UserStorage):
+    """The users saved in the memory of the process, lost when it exits.
+    Meant for the tests, the benchmarks and the small bots running in a
+    single process.
+    """
+
+    def __init__(self):
+        self._users: Dict[int, Dict[str, str]] = dict()
+        self._states: Dict[str, Set[int]] = defaultdict(set)
+        self._activity: Dict[int, float] = dict()
+        self._lock = Lock()
+
+    def listen(self, cache) -> bool:
+        """Every write comes from this process, the cache is always
+        consistent"""
+        return True
+
+    def head(self, user_id: int, consistent: bool = False
+             ) -> Dict[str, str]:
+        user = self._users.get(user_id)
+        if user is None:
+            return dict()
+        return {"id": user["id"], "state": user.get("state")}
+
+    def load(self, user_id: int, consistent: bool = False
+             ) -> Dict[str, str]:
+        return dict(self._users.get(user_id, ()))
+
+    def fields(self, user_id: int, names: Iterable[str],
+               consistent: bool = False) -> Dict[str, Union[str, None]]:
+        user = self._users.get(user_id, dict())
+        return {name: user.get(name) for name in names}
+
+    def create(self, fields: dict) -> Dict[str, str]:
+        user_id = int(fields["id"])
+        with self._lock:
+            if user_id in self._users:
+                return dict(self._users[user_id])
+            self._users[user_id] = {name: str(value)
+                                    for name, value in fields.items()}
+            self._states[str(fields["state"])].add(user_id)
+        return dict()
+
+    def set_fields(self, user_id: int, fields: dict, cache=None) -> int:
+        with self._lock:
+            user = self._users.setdefault(user_id, dict())
+            added = len(set(fields) - set(user))
+            user.update((name, str(value)) for name, value in fields.items())
+        return added
+
+    def transition(self, user_id: int, new_state: str,
+                   expected: Union[str, None] = None, cache=None
+                   ) -> Tuple[int, str]:
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None or "id" not in user:
+                return -1, ""
+            current = user.get("state", "")
+            if expected and current != expected:
+                return 0, current
+            user["state"] = new_state
+            self._states[current].discard(user_id)
+            self._states[new_state].add(user_id)
+        return 1, current
+
+    def count_state(self, state: str) -> int:
+        return len(self._states.get(state, ()))
+
+    def many(self, user_ids: Iterable[int], chunk_size: int = 500,
+             consistent: bool = False) -> Iterator[Dict[str, str]]:
+        for user_id in user_ids:
+            yield self.load(user_id)
+
+    def scan(self, count: int = 1000) -> Iterator[Dict[str, str]]:
+        for user_id in list(self._users):
+            user = self.load(user_id)
+            if user.get("id"):
+                yield user
+
+    def touch(self, activity: Dict[int, float]):
+        with self._lock:
+            for user_id, timestamp in activity.items():
+                if user_id in self._users:
+                    self._users[user_id]["last_activity"] = str(timestamp)
+            self._activity.update(activity)
+
+    def count_active(self, since: float) -> int:
+        return sum(1 for timestamp in self._activity.values()
+                   if timestamp >= since)
+
+    def active_since(self, since: float, start: int = 0,
+                     num: Union[int, None] = None) -> List[int]:
+        ids = [user_id for user_id, timestamp in sorted(
+            self._activity.items(), key=lambda item: item[1])
+            if timestamp >= since]
+        return ids[start:None if num is None else start + num]
@@ -0,0 +1,347 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import redis
+# Required to work with redis
+
+from collections import OrderedDict
+# Needed to expire the users pinned to the primary in order
+
+from heapq import merge
+# Needed to merge the activity of many nodes
+
+from threading import Lock
+# The users are written by many threads
+
+from time import monotonic
+# Needed to pin the users written to the primary for a while
+
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+# Needed for parameters and return hints
+
+from source.objects.redis_connection import (LazyScript, get_redis,
+                                             get_replicas)
+# The shared redis connection, created on first use
+
+from source.objects.storage.base import UserStorage
+# The interface implemented
+
+from source.objects.user_encoding import (decode, encode, encode_value,
+                                          field, read_fields, twin)
+# The user hashes can be written with the compact encoding
+
+STATE_SET = "users:state:"
+# The prefix of the sets of the user ids in every state
+
+ACTIVITY_KEY = "users:activity"
+# The sorted set of the user ids scored by their last activity
+
+CREATE_USER = """
+if redis.call('HEXISTS', KEYS[1], 'id') == 1
+        or redis.call('HEXISTS', KEYS[1], 'i') == 1 then
+    return redis.call('HGETALL', KEYS[1])
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('SADD', KEYS[2], ARGV[1])
+return {}
+"""
+# Write the whole user hash only if it doesn't exist yet, otherwise return
+# it: two updates creating the same user never see a half-written hash and
+# the second one loads what the first one wrote. ARGV[1] is the user id,
+# added to the set of its state KEYS[2], the others are the fields. The
+# hash can be in either encoding
+
+TRANSITION = """
+if redis.call('HEXISTS', KEYS[1], 'id') == 0
+        and redis.call('HEXISTS', KEYS[1], 'i') == 0 then
+    return {-1, ''}
+end
+local current = redis.call('HGET', KEYS[1], ARGV[5])
+    or redis.call('HGET', KEYS[1], ARGV[6]) or ''
+if ARGV[1] ~= '' and current ~= ARGV[1] then
+    return {0, current}
+end
+redis.call('HSET', KEYS[1], ARGV[5], ARGV[2])
+redis.call('HDEL', KEYS[1], ARGV[6])
+if current ~= '' then
+    redis.call('SREM', ARGV[4] .. current, ARGV[3])
+end
+redis.call('SADD', ARGV[4] .. ARGV[2], ARGV[3])
+return {1, current}
+"""
+# Set the state to ARGV[2] only if it's ARGV[1] (or whatever it is if
+# ARGV[1] is ""), in the field ARGV[5], deleting its twin ARGV[6] of the
+# other encoding, moving the user ARGV[3] between the state sets
+# ARGV[4] .. state. Returns
+# 1 if set, 0 if the state didn't match or -1 if the user doesn't exist,
+# and the previous state
+
+_create_user = LazyScript(CREATE_USER)
+_transition = LazyScript(TRANSITION)
+
+
+def script_args(fields: dict) -> list:
+    """Get the ARGV of CREATE_USER: the id, then the encoded fields of the
+    hash flattened"""
+    return [fields["id"]] + [item for pair in encode(fields).items()
+                             for item in pair]
+
+
+def transition_args(telegram_id: int, new_state: str,
+                    expected: Union[str, None]) -> list:
+    """Get the ARGV of TRANSITION"""
+    return [expected or "", new_state, telegram_id, STATE_SET,
+            field("state"), twin("state")]
+
+
+def _first(values: list) -> Union[str, None]:
+    """Get the first value read with read_fields that is present"""
+    return next((value for value in values if value is not None), None)
+
+
+class RedisStorage(UserStorage):
+    """The users saved on redis, every one in the user:{id} hash, with the
+    sets of the users in every state and the sorted set of their last
+    activity. It's the storage used by AsyncUser too.
+
+    Every user is read and written on the node returned by _node, the sets
+    are split among the nodes returned by _nodes and the invalidations of
+    the user cache are published on get_redis(). Here they're all the
+    client of get_redis(), ShardedRedisStorage spreads the users on many.
+
+    The users are read from the replicas of get_replicas(), if any, every
+    user always from the same one, so its reads never go back in time. The
+    consistent reads and the reads of the users written by this process in
+    the last pin_time seconds go to the primary, like every write.
+    """
+
+    def __init__(self, pin_time: float = 1.0):
+        """
+        Parameters
+        ----------
+        pin_time : float, optional
+            How many seconds the users written are read from the primary,
+            it must be longer than the lag of the replicas
+        """
+        self.pin_time = pin_time
+        self._pinned: "OrderedDict[int, float]" = OrderedDict()
+        # user_id -> until when it's read from the primary, oldest first
+        self._lock = Lock()
+
+    def _node(self, user_id: int) -> redis.Redis:
+        """Get the client of the node where a user is saved"""
+        return get_redis()
+
+    def _nodes(self) -> List[redis.Redis]:
+        """Get the clients of every node"""
+        return [get_redis()]
+
+    def _replicas(self) -> List[redis.Redis]:
+        """Get the clients of the replicas where the users are read"""
+        return get_replicas()
+
+    def _reader(self, user_id: int, consistent: bool = False
+                ) -> redis.Redis:
+        """Get the client where a user is read"""
+        replicas = self._replicas()
+        if (not replicas or consistent
+                or self._pinned.get(user_id, 0) > monotonic()):
+            return self._node(user_id)
+        return replicas[int(user_id) % len(replicas)]
+
+    def _pin(self, user_id: int):
+        """Read a user just written from the primary for pin_time seconds,
+        until the replicas have the write"""
+        if not self._replicas():
+            return
+        now = monotonic()
+        with self._lock:
+            self._pinned[user_id] = now + self.pin_time
+            self._pinned.move_to_end(user_id)
+            while self._pinned and next(iter(self._pinned.values())) <= now:
+                self._pinned.popitem(last=False)     # The expired ones
+
+    def _execute(self, node: redis.Redis, pipe, user_id: int, cache
+                 ) -> list:
+        """Run a pipeline of writes of a user, telling the other processes
+        to drop the user from their cache after the writes"""
+        self._pin(user_id)
+        bus = get_redis()
+        if cache is not None and node is bus:
+            cache.publish(pipe, user_id)       # In the same round-trip
+        replies = pipe.execute()
+        if cache is not None and node is not bus:
+            cache.publish(bus, user_id)
+        return replies
+
+    def listen(self, cache) -> bool:
+        """Drop from the cache the users written by the other processes,
+        published on its channel"""
+        cache.listen(get_redis())
+        return True
+
+    def head(self, user_id: int, consistent: bool = False
+             ) -> Dict[str, str]:
+        values = self._reader(user_id, consistent).hmget(
+            f"user:{user_id}", read_fields("id") + read_fields("state"))
+        if _first(values[:2]) is None:
+            return dict()
+        return {"id": _first(values[:2]), "state": _first(values[2:])}
+
+    def load(self, user_id: int, consistent: bool = False
+             ) -> Dict[str, str]:
+        return decode(self._reader(user_id, consistent).hgetall(
+            f"user:{user_id}"))
+
+    def fields(self, user_id: int, names: Iterable[str],
+               consistent: bool = False) -> Dict[str, Union[str, None]]:
+        names = list(names)
+        values = self._reader(user_id, consistent).hmget(
+            f"user:{user_id}",
+            [name for item in names for name in read_fields(item)])
+        result = dict()
+        for name in names:
+            width = len(read_fields(name))
+            result[name], values = _first(values[:width]), values[width:]
+            # The field in any encoding
+        return result
+
+    def create(self, fields: dict) -> Dict[str, str]:
+        self._pin(fields["id"])
+        reply = _create_user(keys=[f"user:{fields['id']}",
+                                   STATE_SET + fields["state"]],
+                             args=script_args(fields),
+                             client=self._node(fields["id"]))
+        return decode(dict(zip(reply[::2], reply[1::2])))
+
+    def set_fields(self, user_id: int, fields: dict, cache=None) -> int:
+        mapping = {field(name): encode_value(name, value)
+                   for name, value in fields.items()}
+        twins = [twin(name) for name in fields if twin(name)]
+        node = self._node(user_id)
+        pipe = node.pipeline(transaction=False)
+        pipe.hset(f"user:{user_id}", mapping=mapping)
+        if twins:
+            pipe.hdel(f"user:{user_id}", *twins)
+            # Never keep a field in both encodings
+        return self._execute(node, pipe, user_id, cache)[0]
+
+    def transition(self, user_id: int, new_state: str,
+                   expected: Union[str, None] = None, cache=None
+                   ) -> Tuple[int, str]:
+        node = self._node(user_id)
+        pipe = node.pipeline(transaction=False)
+        _transition(keys=[f"user:{user_id}"],
+                    args=transition_args(user_id, new_state, expected),
+                    client=pipe)
+        done, current = self._execute(node, pipe, user_id, cache)[0]
+        return done, current
+
+    def count_state(self, state: str) -> int:
+        return sum(node.scard(STATE_SET + state) for node in self._nodes())
+
+    def _read(self, user_ids: List[int], consistent: bool = False
+              ) -> List[Dict[str, str]]:
+        """Get many users with a single round-trip to every node"""
+        pipes = dict()
+        # id(node) -> the pipeline and the positions of its users
+        for position, user_id in enumerate(user_ids):
+            node = self._reader(user_id, consistent)
+            if id(node) not in pipes:
+                pipes[id(node)] = (node.pipeline(transaction=False), [])
+            pipe, positions = pipes[id(node)]
+            pipe.hgetall(f"user:{user_id}")
+            positions.append(position)
+        users: List[Dict[str, str]] = [dict()] * len(user_ids)
+        for pipe, positions in pipes.values():
+            for position, data in zip(positions, pipe.execute()):
+                users[position] = decode(data)
+        return users
+
+    def many(self, user_ids: Iterable[int], chunk_size: int = 500,
+             consistent: bool = False) -> Iterator[Dict[str, str]]:
+        chunk = []
+        for user_id in user_ids:
+            chunk.append(user_id)
+            if len(chunk) >= chunk_size:
+                yield from self._read(chunk, consistent)
+                chunk = []
+        if chunk:
+            yield from self._read(chunk, consistent)
+
+    def scan(self, count: int = 1000) -> Iterator[Dict[str, str]]:
+        """Walk every user with SCAN, node by node, reading the hashes of
+        every batch of keys in a single round-trip. The users created or
+        deleted during the walk may be skipped or not."""
+        for node in self._nodes():
+            batch = []
+            for key in node.scan_iter(match="user:*", count=count):
+                if key[5:].isdigit():      # Skip the other keys, like user:x:y
+                    batch.append(int(key[5:]))
+                if len(batch) >= count:
+                    yield from self._read(batch)
+                    batch = []
+            if batch:
+                yield from self._read(batch)
+
+    def touch(self, activity: Dict[int, float]):
+        """Write the last activity fields and the activity sorted set in a
+        single round-trip to every node"""
+        name, other = field("last_activity"), twin("last_activity")
+        pipes = dict()
+        for user_id, timestamp in activity.items():
+            node = self._node(user_id)
+            if id(node) not in pipes:
+                pipes[id(node)] = (node.pipeline(transaction=False), dict())
+            pipe, scores = pipes[id(node)]
+            pipe.hset(f"user:{user_id}", name,
+                      encode_value("last_activity", timestamp))
+            pipe.hdel(f"user:{user_id}", other)
+            scores[str(user_id)] = timestamp
+        for pipe, scores in pipes.values():
+            pipe.zadd(ACTIVITY_KEY, scores)
+            pipe.execute()
+
+    def count_active(self, since: float) -> int:
+        return sum(node.zcount(ACTIVITY_KEY, since, "+inf")
+                   for node in self._nodes())
+
+    def active_since(self, since: float, start: int = 0,
+                     num: Union[int, None] = None) -> List[int]:
+        nodes = self._nodes()
+        if len(nodes) == 1:
+            ids = nodes[0].zrangebyscore(ACTIVITY_KEY, since, "+inf",
+                                         start=start,
+                                         num=-1 if num is None else num)
+            # A negative count is every user after start
+        else:
+            limit = None if num is None else start + num
+            ranges = [node.zrangebyscore(ACTIVITY_KEY, since, "+inf",
+                                         start=None if limit is None else 0,
+                                         num=limit, withscores=True)
+                      for node in nodes]
+            ids = [user_id for user_id, _ in merge(
+                *ranges, key=lambda item: item[1])][start:limit]
+            # Every node gives its first users, merged by activity
+        return [int(user_id) for user_id in ids]
@@ -0,0 +1,122 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import redis
+# Required to work with redis
+
+from bisect import bisect
+# Needed to find the node of a key on the ring
+
+from hashlib import md5
+# Spreads the keys and the nodes on the ring, the same in every process
+
+from typing import Dict, List
+# Needed for parameters and return hints
+
+from source.objects.storage.redis_storage import RedisStorage
+# The same hashes, sets and scripts, on many nodes
+
+
+class HashRing:
+    """A consistent hashing ring: every node is placed on it many times and
+    a key belongs to the first node after it. Adding or removing a node
+    moves only the keys of that node, about 1/n of them.
+
+    Methods
+    -------
+    node(key: str)
+        Get the name of the node where a key belongs
+    """
+
+    def __init__(self, nodes: List[str], replicas: int = 128):
+        """
+        Parameters
+        ----------
+        nodes : List[str]
+            The names of the nodes, not their URLs, so changing a
+            password or a host doesn't move the users
+        replicas : int, optional
+            How many times every node is placed on the ring, more spread the
+            keys more evenly
+        """
+        if not nodes:
+            raise ValueError("A hash ring needs at least a node")
+        points = sorted((self._hash(f"{name}#{replica}"), name)
+                        for name in nodes for replica in range(replicas))
+        self._points = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        """Get the position of a key on the ring"""
+        return int.from_bytes(md5(key.encode()).digest()[:8], "big")
+
+    def node(self, key: str) -> str:
+        """Get the name of the node where a key belongs
+
+        Parameters
+        ----------
+        key : str
+            The redis key, like user:{id}
+
+        Returns
+        -------
+        str
+            The name of the node
+        """
+        index = bisect(self._points, self._hash(key))
+        return self._names[index % len(self._names)]
+
+
+class ShardedRedisStorage(RedisStorage):
+    """The users of RedisStorage spread on many redis nodes by consistent
+    hashing of their user:{id} key. Every node has its own share of the
+    state sets and of the activity sorted set, so a user and its indexes
+    are always written together by the same scripts; counting and scanning
+    go through every node. The cache invalidations are published on the
+    client of get_redis(), shared by every process. The replicas are not
+    used, they're replicas of get_redis() only.
+    """
+
+    def __init__(self, nodes: Dict[str, redis.Redis], replicas: int = 128):
+        """
+        Parameters
+        ----------
+        nodes : Dict[str, redis.Redis]
+            The client of every node, by name
+        replicas : int, optional
+            How many times every node is placed on the ring
+        """
+        super().__init__()
+        self.nodes = nodes
+        self.ring = HashRing(list(nodes), replicas)
+
+    def _node(self, user_id: int) -> redis.Redis:
+        return self.nodes[self.ring.node(f"user:{user_id}")]
+
+    def _nodes(self) -> List[redis.Redis]:
+        return list(self.nodes.values())
+
+    def _replicas(self) -> List[redis.Redis]:
+        return []
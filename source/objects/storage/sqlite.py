@@ -0,0 +1,236 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import sqlite3
+# Required to work with sqlite
+
+from contextlib import contextmanager
+# Needed to run the writes in a transaction
+
+from threading import Lock
+# The connection is shared by the threads of the process
+
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+# Needed for parameters and return hints
+
+from source.objects.storage.base import UserStorage
+# The interface implemented
+
+COLUMNS = ("id", "first_name", "last_name", "username", "last_activity",
+           "state")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    first_name TEXT,
+    last_name TEXT,
+    username TEXT,
+    last_activity REAL,
+    state TEXT
+);
+CREATE INDEX IF NOT EXISTS users_state ON users (state);
+CREATE INDEX IF NOT EXISTS users_activity ON users (last_activity);
+"""
+
+_CHUNK = 500
+# Less than the variables allowed in a query by old sqlite versions
+
+
+def _row(row: Union[sqlite3.Row, None]) -> Dict[str, str]:
+    """Get a user as str fields, like they are read from redis"""
+    if row is None:
+        return dict()
+    return {name: str(row[name]) for name in row.keys()
+            if row[name] is not None}
+
+
+class SQLiteStorage(UserStorage):
+    """The users saved in a sqlite database, for the bots running without
+    redis. The database is in WAL mode, so the readers don't wait for the
+    writer, and the activity of many users is written in a single
+    transaction. Only the fields in COLUMNS can be saved.
+    """
+
+    def __init__(self, path: str = "./data/users.sqlite3",
+                 timeout: float = 5.0):
+        """
+        Parameters
+        ----------
+        path : str, optional
+            The path of the database, created if missing
+        timeout : float, optional
+            How many seconds a write waits for the other processes
+        """
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=timeout,
+                                           isolation_level=None,
+                                           check_same_thread=False)
+        # isolation_level None, the transactions are opened explicitly
+        self._connection.row_factory = sqlite3.Row
+        self._lock = Lock()
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            # Safe in WAL mode, the last transactions may be lost only if
+            # the machine crashes
+            self._connection.executescript(SCHEMA)
+
+    def _query(self, sql: str, parameters: Iterable = ()) -> List[sqlite3.Row]:
+        """Run a read query"""
+        with self._lock:
+            return self._connection.execute(sql, tuple(parameters)).fetchall()
+
+    @contextmanager
+    def _write(self):
+        """Run the writes in a single transaction, taking the write lock of
+        the database at once so the reads in it are consistent"""
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    @staticmethod
+    def _columns(fields: Iterable[str]) -> List[str]:
+        """Check that the fields can be saved"""
+        fields = list(fields)
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"The fields {', '.join(sorted(unknown))} "
+                             f"can't be saved on sqlite")
+        return fields
+
+    def head(self, user_id: int, consistent: bool = False
+             ) -> Dict[str, str]:
+        rows = self._query("SELECT id, state FROM users WHERE id = ?",
+                           (user_id,))
+        return _row(rows[0] if rows else None)
+
+    def load(self, user_id: int, consistent: bool = False
+             ) -> Dict[str, str]:
+        rows = self._query("SELECT * FROM users WHERE id = ?", (user_id,))
+        return _row(rows[0] if rows else None)
+
+    def fields(self, user_id: int, names: Iterable[str],
+               consistent: bool = False) -> Dict[str, Union[str, None]]:
+        names = self._columns(names)
+        rows = self._query(f"SELECT {', '.join(names)} FROM users "
+                           f"WHERE id = ?", (user_id,))
+        user = _row(rows[0] if rows else None)
+        return {name: user.get(name) for name in names}
+
+    def create(self, fields: dict) -> Dict[str, str]:
+        names = self._columns(fields)
+        with self._write() as connection:
+            cursor = connection.execute(
+                f"INSERT OR IGNORE INTO users ({', '.join(names)}) VALUES "
+                f"({', '.join('?' * len(names))})", tuple(fields.values()))
+            if cursor.rowcount:
+                return dict()
+            return _row(connection.execute("SELECT * FROM users WHERE id = ?",
+                                           (fields["id"],)).fetchone())
+
+    def set_fields(self, user_id: int, fields: dict, cache=None) -> int:
+        """Change some fields of a user, the fields added are the ones that
+        were NULL, like the ones missing from a redis hash. A user not
+        saved is not created, so nothing is added"""
+        names = self._columns(fields)
+        assignments = ", ".join(f"{name} = ?" for name in names)
+        with self._write() as connection:
+            row = connection.execute(f"SELECT {', '.join(names)} FROM users "
+                                     f"WHERE id = ?", (user_id,)).fetchone()
+            if row is None:
+                return 0
+            connection.execute(f"UPDATE users SET {assignments} WHERE id = ?",
+                               tuple(fields.values()) + (user_id,))
+        return sum(row[name] is None for name in names)
+
+    def transition(self, user_id: int, new_state: str,
+                   expected: Union[str, None] = None, cache=None
+                   ) -> Tuple[int, str]:
+        with self._write() as connection:
+            row = connection.execute("SELECT state FROM users WHERE id = ?",
+                                     (user_id,)).fetchone()
+            if row is None:
+                return -1, ""
+            current = row["state"] or ""
+            if expected and current != expected:
+                return 0, current
+            connection.execute("UPDATE users SET state = ? WHERE id = ?",
+                               (new_state, user_id))
+        return 1, current
+
+    def count_state(self, state: str) -> int:
+        return self._query("SELECT COUNT(*) FROM users WHERE state = ?",
+                           (state,))[0][0]
+
+    def many(self, user_ids: Iterable[int], chunk_size: int = 500,
+             consistent: bool = False) -> Iterator[Dict[str, str]]:
+        chunk_size = min(chunk_size, _CHUNK)
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+            rows = self._query(f"SELECT * FROM users WHERE id IN "
+                               f"({', '.join('?' * len(chunk))})", chunk)
+            users = {row["id"]: _row(row) for row in rows}
+            for user_id in chunk:
+                yield users.get(int(user_id), dict())
+
+    def scan(self, count: int = 1000) -> Iterator[Dict[str, str]]:
+        """Walk every user by id, reading count users with every query"""
+        last = None
+        while True:
+            if last is None:
+                rows = self._query("SELECT * FROM users ORDER BY id LIMIT ?",
+                                   (count,))
+            else:
+                rows = self._query("SELECT * FROM users WHERE id > ? "
+                                   "ORDER BY id LIMIT ?", (last, count))
+            if not rows:
+                return
+            for row in rows:
+                yield _row(row)
+            last = rows[-1]["id"]
+
+    def touch(self, activity: Dict[int, float]):
+        """Write the activity of every user in a single transaction"""
+        with self._write() as connection:
+            connection.executemany(
+                "UPDATE users SET last_activity = ? WHERE id = ?",
+                [(timestamp, user_id) for user_id, timestamp
+                 in activity.items()])
+
+    def count_active(self, since: float) -> int:
+        return self._query("SELECT COUNT(*) FROM users "
+                           "WHERE last_activity >= ?", (since,))[0][0]
+
+    def active_since(self, since: float, start: int = 0,
+                     num: Union[int, None] = None) -> List[int]:
+        rows = self._query("SELECT id FROM users WHERE last_activity >= ? "
+                           "ORDER BY last_activity LIMIT ? OFFSET ?",
+                           (since, -1 if num is None else num, start))
+        return [row["id"] for row in rows]
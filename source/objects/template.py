@@ -0,0 +1,294 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import re
+# Needed to split the templates that str.format can't parse
+
+from functools import lru_cache
+# Needed to share the templates compiled from the same text
+
+from string import Formatter
+# Needed to parse the templates once
+
+from typing import Dict, NamedTuple, Tuple, Union
+# Needed for parameters and return hints
+
+
+_formatter = Formatter()
+_fallback_field = re.compile(r"{(\w+)}")
+# The placeholders replaced when a template is not valid for str.format
+
+
+class _Field(NamedTuple):
+    """A placeholder inside a template"""
+    key: str
+    # The key looked up in the replacements
+    name: str
+    # The full field name, it differs from key for {key.attr} and {key[0]}
+    spec: str
+    # The format spec, as in {key:spec}
+    conversion: Union[str, None]
+    # The conversion, as in {key!r}
+    raw: str
+    # The placeholder as written in the template, used if key is not passed
+
+    def render(self, replaces: dict) -> str:
+        """Get the text of the placeholder
+
+        Parameters
+        ----------
+        replaces : dict
+            The values of the placeholders
+
+        Returns
+        -------
+        str
+            The formatted value, or the placeholder itself if its key is
+            not in replaces
+        """
+
+        if self.key not in replaces:
+            return self.raw
+        value = replaces[self.key]
+        if self.name == self.key and not self.spec and not self.conversion:
+            return value if type(value) is str else str(value)
+        try:
+            value = _formatter.get_field(self.name, (), replaces)[0]
+            value = _formatter.convert_field(value, self.conversion)
+            return format(value, self.spec)
+        except (AttributeError, LookupError, TypeError, ValueError):
+            return self.raw
+
+
+_Segment = Union[str, _Field]
+
+
+class Template:
+    """A message template parsed once in literal text and placeholders.
+
+    The template is normalized in a format string where only its
+    placeholders are left, so when every placeholder key is passed it's
+    rendered with a single str.format_map call, otherwise the segments are
+    joined keeping the missing placeholders as they are.
+
+    Attributes
+    ----------
+    source : str
+        The text the template was compiled from
+    segments : Tuple[Union[str, _Field], ...]
+        The literal strings and the placeholders of the template
+
+    Methods
+    -------
+    compile(text: str) -> Template
+        Parse a text into a template
+
+    bake(values: dict) -> Template
+        Get a copy of the template with some placeholders already replaced
+
+    render(replaces: dict) -> str
+        Replace the placeholders and get the text
+
+    placeholders() -> Tuple[str, ...]
+        Get the keys of the placeholders of the template
+    """
+    __slots__ = ("source", "segments", "_literal", "_format", "_keys")
+
+    def __init__(self, source: str, segments: Tuple[_Segment, ...]):
+        self.source = source
+        self.segments = _merge(segments)
+        self._literal = None
+        if not self.segments:
+            self._literal = ""
+        elif len(self.segments) == 1 and type(self.segments[0]) is str:
+            self._literal = self.segments[0]
+            # Nothing to replace, render returns this string as it is
+        self._format = "".join([
+            segment.replace("{", "{{").replace("}", "}}")
+            if type(segment) is str else segment.raw
+            for segment in self.segments])
+        self._keys = frozenset(self.placeholders())
+
+    def __getstate__(self):
+        return (self.source, self.segments, self._literal, self._format,
+                self._keys)
+
+    def __setstate__(self, state):
+        (self.source, self.segments, self._literal, self._format,
+         self._keys) = state
+        # Loaded from a bundle, nothing to compute again
+
+    def __repr__(self) -> str:
+        return f"<Template {self.source!r}>"
+
+    @classmethod
+    def compile(cls, text: str) -> "Template":
+        """Parse a text into a template, using the str.format syntax. If the
+        text is not valid for str.format only the {key} placeholders are
+        recognized and every other character is kept as it is.
+
+        Parameters
+        ----------
+        text : str
+            The text to parse
+
+        Returns
+        -------
+        Template
+            The compiled template
+        """
+
+        try:
+            return cls(text, tuple(_parse(text)))
+        except ValueError:
+            parts = _fallback_field.split(text)
+            # literal, key, literal, key, ..., literal
+            return cls(text, tuple(
+                part if i % 2 == 0 else _Field(part, part, "", None,
+                                               "{" + part + "}")
+                for i, part in enumerate(parts)))
+
+    @property
+    def is_static(self) -> bool:
+        """True if the template has no placeholders"""
+        return self._literal is not None
+
+    def placeholders(self) -> Tuple[str, ...]:
+        """Get the keys of the placeholders of the template
+
+        Returns
+        -------
+        Tuple[str, ...]
+            The keys, in order of appearance
+        """
+
+        return tuple(segment.key for segment in self.segments
+                     if type(segment) is _Field)
+
+    def bake(self, values: Dict[str, str]) -> "Template":
+        """Get a copy of the template where the placeholders of the passed
+        keys are already replaced, used for the values that never change
+        like the bot username
+
+        Parameters
+        ----------
+        values : Dict[str, str]
+            The values to replace
+
+        Returns
+        -------
+        Template
+            The new template, or this one if nothing was replaced
+        """
+
+        if self._keys.isdisjoint(values):
+            return self
+        return Template(self.source, tuple(
+            segment.render(values)
+            if type(segment) is _Field and segment.key in values
+            else segment for segment in self.segments))
+
+    def render(self, replaces: Union[dict, None] = None) -> str:
+        """Replace the placeholders and get the text. The placeholders whose
+        key is not in replaces are kept as they are.
+
+        Parameters
+        ----------
+        replaces : dict, None, optional
+            The values of the placeholders
+
+        Returns
+        -------
+        str
+            The rendered text
+        """
+
+        if self._literal is not None:
+            return self._literal
+        if not replaces:
+            replaces = {}
+        elif replaces.keys() >= self._keys:
+            try:
+                return self._format.format_map(replaces)
+            except (AttributeError, LookupError, TypeError, ValueError):
+                pass
+                # A {key.attr} or {key:spec} the value doesn't support
+        return "".join([segment if type(segment) is str
+                        else segment.render(replaces)
+                        for segment in self.segments])
+
+
+@lru_cache(maxsize=65536)
+def compile_template(text: str) -> Template:
+    """Template.compile with a process-wide cache. Templates are never
+    modified, so the same text compiles once and the template is shared,
+    like the button labels repeated across statuses and languages.
+
+    Parameters
+    ----------
+    text : str
+        The text to parse
+
+    Returns
+    -------
+    Template
+        The compiled template
+    """
+
+    return Template.compile(text)
+
+
+def _parse(text: str):
+    """Split a text in literals and placeholders with str.format rules
+
+    Raises
+    ------
+    ValueError
+        If the text is not valid for str.format
+    """
+
+    for literal, name, spec, conversion in _formatter.parse(text):
+        if literal:
+            yield literal
+        if name is None:
+            continue
+        key = re.split(r"[.\[]", name, 1)[0]
+        if not key or key.isdigit():
+            raise ValueError("Positional fields are not supported")
+        raw = "{" + name + ("!" + conversion if conversion else "") + (
+            ":" + spec if spec else "") + "}"
+        yield _Field(key, name, spec, conversion, raw)
+
+
+def _merge(segments: Tuple[_Segment, ...]) -> Tuple[_Segment, ...]:
+    """Join the adjacent literals and remove the empty ones"""
+    merged = []
+    for segment in segments:
+        if type(segment) is str:
+            if not segment:
+                continue
+            if merged and type(merged[-1]) is str:
+                merged[-1] += segment
+                continue
+        merged.append(segment)
+    return tuple(merged)
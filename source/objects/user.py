@@ -22,32 +22,351 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import redis
-# Required to work with redis
+from source.objects.redis_connection import setting
+# The user cache is configured in the redis config category
 
-from source.objects.config_parser import ConfigParser
-# Configuration parser to get redis db info
+from source.objects.storage import get_storage
+# Where the users are saved, redis by default
 
 from botogram import User as bUser
 # Get a botogram.User class and save it as bUser
 
-from typing import Union
+from typing import Iterable, Iterator, List, NamedTuple, Tuple, Union
 # Needed for parameters and return hints
 
 from datetime import datetime as dt
 # Needed to save the last activity
 
-config = ConfigParser("data/configs/config.json")
-# Load the config file and parse it
+from source.objects.user_cache import UserCache
+# The optional in-process cache of the users
 
-r = redis.Redis(host=config.redis.IP, db=config.redis.DATABASE,
-                port=config.redis.PORT, password=config.redis.PASSWORD,
-                decode_responses=True)
-# Connect to the redis database
+from source.objects.activity import get_tracker
+# Writes the last activity of the users in batches
 
+from contextlib import contextmanager
+# Needed to read consistently within a block
 
-class User:
-    """The User object represents a Telegram user in the redis database. It
+from threading import local
+# Every thread handles its own update
+
+_cache: Union[UserCache, None] = None
+_cache_checked = False
+_reads = local()
+
+
+def get_cache() -> Union[UserCache, None]:
+    """Get the in-process user cache, created on the first call from the
+    user-cache-size and user-cache-ttl keys of the redis config category
+
+    Returns
+    -------
+    Union[UserCache, None]
+        The cache, None if user-cache-size is 0 or not set or if the storage
+        can't keep it consistent
+    """
+
+    global _cache, _cache_checked
+    if not _cache_checked:
+        _cache_checked = True
+        size = int(setting("user-cache-size", 0))
+        if size > 0:
+            cache = UserCache(size, float(setting("user-cache-ttl", 60)))
+            if get_storage().listen(cache):
+                _cache = cache
+    return _cache
+
+
+@contextmanager
+def consistent_reads():
+    """Read the users from the primary, not from the replicas, in this
+    thread until the block exits, for the updates that must see every
+    write done before, even by the other processes
+
+    Yields
+    ------
+    None
+    """
+
+    previous = getattr(_reads, "consistent", False)
+    _reads.consistent = True
+    try:
+        yield
+    finally:
+        _reads.consistent = previous
+
+
+def _consistent_read(consistent: bool) -> bool:
+    """If a read must be consistent, asked or within consistent_reads"""
+    return consistent or getattr(_reads, "consistent", False)
+
+
+def user_id(botogram_user: Union[bUser, None], telegram_id: int) -> int:
+    """Get the id of the user to create or load
+
+    Parameters
+    ----------
+    botogram_user : botogram.User, None
+        The Telegram user
+    telegram_id : int
+        The Telegram ID of the user, 0 to use the botogram User
+
+    Returns
+    -------
+    int
+        The Telegram ID of the user
+
+    Raises
+    ------
+    ValueError
+        If neither the botogram_user nor telegram_id is provided or if both
+        are provided and don't match
+    """
+
+    if not any((botogram_user, telegram_id)):
+        # If both arguments are left to be default
+
+        raise ValueError("Expected either botogram_user"
+                         "or telegram_id values")
+        # Raise a ValueError (at least one is required)
+
+    if botogram_user and telegram_id and botogram_user.id != telegram_id:
+        raise ValueError("Both a Botogram User and a Telegram"
+                         " ID were passed, but they didn't match")
+
+    return botogram_user.id if botogram_user else telegram_id
+
+
+def new_user(botogram_user: bUser) -> dict:
+    """Get the fields of the hash of a new user
+
+    Parameters
+    ----------
+    botogram_user : botogram.User
+        The Telegram user
+
+    Returns
+    -------
+    dict
+        The fields, id first
+    """
+
+    return {"id": botogram_user.id,
+            "first_name": botogram_user.first_name,
+            "last_name": botogram_user.last_name or "",
+            # ("" if not present)
+            "username": botogram_user.username or "",
+            # ("" if not present)
+            "last_activity": dt.timestamp(dt.now()),
+            "state": "home"}
+
+
+def count_state(state: str) -> int:
+    """Count the users in a state, with a single SCARD on redis
+
+    Parameters
+    ----------
+    state : str
+        The state
+
+    Returns
+    -------
+    int
+        How many users are in the state
+    """
+
+    return get_storage().count_state(state)
+
+
+class UserRecord(NamedTuple):
+    """A read-only snapshot of a user hash, as returned by User.many and
+    iter_users"""
+    id: int
+    first_name: str
+    last_name: str
+    username: str
+    last_activity: Union[float, None]
+    state: str
+
+    @classmethod
+    def from_hash(cls, data: dict) -> "UserRecord":
+        """Build the record from the user hash, as returned by hgetall
+
+        Parameters
+        ----------
+        data : dict
+            The fields of the user hash, id included
+
+        Returns
+        -------
+        UserRecord
+            The record, last_activity is None if it's not a float
+        """
+
+        try:
+            last_activity = float(data.get("last_activity"))
+        except (TypeError, ValueError):
+            last_activity = None
+            # A broken user doesn't stop a broadcast
+        return cls(int(data["id"]), data.get("first_name"),
+                   data.get("last_name"), data.get("username"),
+                   last_activity, data.get("state"))
+
+
+def iter_users(count: int = 1000) -> Iterator[UserRecord]:
+    """Walk every user, on redis with SCAN reading the hashes of every batch
+    of keys in a single round-trip. Only a batch is kept in memory and the
+    users created or deleted during the walk may be skipped or not.
+
+    Parameters
+    ----------
+    count : int, optional
+        The COUNT hint passed to SCAN and the size of the batches read
+
+    Yields
+    ------
+    UserRecord
+        Every user, in no particular order
+    """
+
+    yield from _records(get_storage().scan(count))
+
+
+def _records(hashes: Iterable[dict]) -> Iterator[UserRecord]:
+    """Build the records of the hashes that are still present"""
+    for data in hashes:
+        if data.get("id"):
+            yield UserRecord.from_hash(data)
+
+
+def _record_or_none(hashes: Iterable[dict]
+                    ) -> Iterator[Union[UserRecord, None]]:
+    """Build the records of the hashes, None for the missing ones"""
+    for data in hashes:
+        yield UserRecord.from_hash(data) if data.get("id") else None
+
+
+class BaseUser:
+    """The fields of a user hash shared by User and AsyncUser
+
+    Methods
+    -------
+    _parse(data: dict)
+        Get the fields other than id and state from the user hash
+    _load(data: dict)
+        Set the attributes from the user hash
+    _cast(value: str, type_of_return: type = str)
+        Cast a value read from redis
+    """
+    __slots__ = ()
+
+    @classmethod
+    def _parse(cls, data: dict) -> dict:
+        """Get the fields other than id and state from the user hash, as
+        returned by hgetall, with their types
+
+        Parameters
+        ----------
+        data : dict
+            The fields of the user hash
+
+        Returns
+        -------
+        dict
+            The first_name, last_name, username and last_activity
+
+        Raises
+        ------
+        TypeError
+            If last_activity is not a float
+        """
+
+        return {"first_name": data.get("first_name"),
+                "last_name": data.get("last_name"),
+                "username": data.get("username"),
+                "last_activity": cls._cast(data.get("last_activity"), float)}
+
+    def _load(self, data: dict):
+        """Set the attributes from the user hash, as returned by hgetall
+
+        Parameters
+        ----------
+        data : dict
+            The fields of the user hash
+
+        Raises
+        ------
+        TypeError
+            If last_activity is not a float
+        """
+
+        for name, value in self._parse(data).items():
+            setattr(self, name, value)
+        self._state = data.get("state")
+
+    @staticmethod
+    def _cast(value: Union[str, None], type_of_return: type = str
+              ) -> Union[str, int, float]:
+        """Function which casts a value read from redis
+
+        Parameters
+        ----------
+        value : str, None
+            The value read from redis
+        type_of_return : type, optional
+            How to return the value, either as a str, an int or a float,
+            defaults to str
+
+        Returns
+        -------
+        Union[str, int, float]
+            The value, either an int, a float or a str
+
+        Raises
+        ------
+        TypeError
+            If the value is not an int or a float, and it's requested as
+            such, raise a TypeError
+        """
+
+        if type_of_return is int:                # If it's requested as an int
+            try:                                 # Try to cast and return
+                return int(value)
+            except (TypeError, ValueError):
+                raise TypeError("The requested value from Redis is not an int")
+                # Alert if not possible
+        elif type_of_return is float:            # If it's requested as a float
+            try:                                 # Try to cast and return
+                return float(value)
+            except (TypeError, ValueError):
+                raise TypeError("The requested value "
+                                "from Redis is not a float")
+                # Alert if not possible
+        return value
+
+
+DEFERRED = ("first_name", "last_name", "username", "last_activity")
+# The fields of User loaded on first access
+
+
+def _deferred(name: str) -> property:
+    """A field of User loaded, with the other deferred ones, on first access.
+    Setting it marks it to be written by User.save"""
+
+    def get(self):
+        if name not in self._fields and not self._loaded:
+            self._load_deferred()
+        return self._fields.get(name)
+
+    def set(self, value):
+        self._fields[name] = value
+        self._dirty.add(name)
+
+    return property(get, set)
+
+
+class User(BaseUser):
+    """The User object represents a Telegram user in the storage, the redis
+    database by default. It
     contains the user username (if present),
     his Telegram ID, First Name, Last Name and last activity
 
@@ -66,15 +385,42 @@ class User:
         if the user doesn't have an username on
         Telegram
     last_activity : float
-        User's last activity on the BOT
+        User's last activity on the BOT, refreshed every time the user is
+        got with a botogram User
+
+    Only the id and the state are read when the user is loaded, the other
+    attributes are read together on the first access to any of them.
+    Changing them marks them as dirty and save() writes them.
+
+    The reads may be served by the redis replicas, unless the user is
+    consistent or got within consistent_reads. After a write every read of
+    the user goes to the primary.
 
     Methods
     -------
-    state(new_state: str = "")
-        Sets a new state for the user or returns the current one
+    state(new_state: str = "", expected: str = None)
+        Sets a new state for the user, if the current one is the expected
+        one, or returns the current one
+
+    touch()
+        Sets the user's last activity to now
+
+    save()
+        Writes the changed attributes to redis
+
+    many(ids: Iterable[int], chunk_size: int = 500, consistent: bool = False)
+        Gets many users at once as UserRecord objects
     """
+    __slots__ = ("id", "redis_hash", "_state", "_fields", "_loaded",
+                 "_dirty", "_consistent")
+
+    first_name = _deferred("first_name")
+    last_name = _deferred("last_name")
+    username = _deferred("username")
+    last_activity = _deferred("last_activity")
 
-    def __init__(self, botogram_user: bUser = None, telegram_id: int = 0):
+    def __init__(self, botogram_user: bUser = None, telegram_id: int = 0,
+                 consistent: bool = False):
         """Initializes the user entry in redis or gets the user data, if already
         present
 
@@ -86,6 +432,8 @@ class User:
         telegram_id : int, optional
             The Telegram ID of the user to be recalled from redis, leave empty
             to use the botogram User
+        consistent : bool, optional
+            Read the user from the primary, never from the replicas
 
         Raises
         ------
@@ -94,81 +442,180 @@ class User:
             are provided and don't match
         """
 
-        if not all((botogram_user, telegram_id)):
-            # If both arguments are left to be default
+        self.id = user_id(botogram_user, telegram_id)
+        # Save its id as an attribute
 
-            raise ValueError("Expected either botogram_user"
-                             "or telegram_id values")
-            # Raise a ValueError (at least one is required)
+        self.redis_hash = f"user:{self.id}"
+        # Get it's redis hash from the id
 
-        if (botogram_user and not telegram_id
-                or botogram_user.id == telegram_id):
-            # If a botogram User is passed or both are passed and they match
-            self.id = botogram_user.id  # Save its id as an attribute
+        self._fields = dict()        # The deferred fields read or set
+        self._loaded = False         # If the deferred fields were read
+        self._dirty = set()          # The deferred fields to be saved
+        self._consistent = _consistent_read(consistent)
+        # If the reads go to the primary
 
-            self.redis_hash = f"user:{self.id}"
-            # Get it's redis hash from the id
+        data, full = self._fetch()
+        # Get the user in a single round-trip, it's empty if the user is
+        # not present on redis
 
-            if not (self._get_redis_value("id")):  # If its user data is not
-                # present on redis
+        if data.get("id") and full:  # If the user is present on redis
+            self._load(data)         # Get its info from the hash
 
-                self.first_name = botogram_user.first_name
-                # Save its first name on tg as an attribute
+        elif data.get("id"):
+            self._state = data.get("state")
+            # Get the other info on first access
 
-                self.last_name = botogram_user.last_name
-                # Save its last name on tg as an attribute
-                # (None if not present)
+        elif botogram_user:          # If a botogram User is passed
 
-                self.username = botogram_user.username
-                # Save its username on tg as an attribute (None if not present)
+            fields = new_user(botogram_user)
+            self._load(fields)
+            # Save its names on tg and the last activity as attributes
 
-                self.last_activity = dt.timestamp(dt.now())
-                self._state = "home"
+            existing = self._create(fields)
+            # Save the user on redis in a single round-trip
 
-                self._set_redis_value("first_name", self.first_name)
-                # Set its first name on redis
+            if existing:
+                self._load(existing)
+                # Another update created the user first, use its data
 
-                self._set_redis_value("last_name", self.last_name)
-                # Set its last name on redis
+        else:
+            raise ValueError("User not found in the redis database,"
+                             " cannot utilize the telegram id")
+            # Can't get data from an id, so raise ValueError
 
-                self._set_redis_value("username", self.username)
-                # Set its username on redis
+        if botogram_user:            # If the user is sending an update
+            self.touch()
 
-                self._set_redis_value("last_activity", self.last_activity)
-                # Set its last activity on redis
+    def _fetch(self) -> Tuple[dict, bool]:
+        """Get the user from the cache or redis. Without the cache only the
+        id and the state are read
 
-                self.state(self._state)
-                # Save the user state
+        Returns
+        -------
+        Tuple[dict, bool]
+            The fields of the user hash, empty if the user is not present,
+            and if the hash is complete
+        """
 
-            else:           # If the user is present on redis
-                # Get its info
-                self.first_name = self._get_redis_value("first_name")
-                self.last_name = self._get_redis_value("last_name")
-                self.username = self._get_redis_value("username")
-                self.last_activity = self._get_redis_value("last_activity",
-                                                           float)
-                self._state = self.state()
+        cache = get_cache()
+        if cache is None:
+            return get_storage().head(self.id, self._consistent), False
 
-        elif telegram_id and not botogram_user:    # If a telegram id is passed
-            self.id = telegram_id                  # Save it as an attribute
-            self.redis_hash = f"user:{self.id}"    # Get the redis hash
+        data = cache.get(self.id)
+        if data is None:
+            generation = cache.generation()
+            data = get_storage().load(self.id, consistent=True)
+            # Not from a replica that may not have the write invalidated
+            if data.get("id"):
+                cache.put(self.id, data, generation)
+                # Unless another process changed it during the read
+        return data, True
 
-            # Check if it's present on redis
-            if not(self._get_redis_value("id")):
-                raise ValueError("User not found in the redis database,"
-                                 " cannot utilize the telegram id")
-                # Can't get data from an id, so raise ValueError
+    def _load(self, data: dict):
+        """Set the attributes from the complete user hash, as returned by
+        hgetall, except the ones changed and not saved yet
 
-            # Else get its data
-            self.first_name = self._get_redis_value("first_name")
-            self.last_name = self._get_redis_value("last_name")
-            self.username = self._get_redis_value("username")
-            self.last_activity = self._get_redis_value("last_activity", float)
-            self._state = self.state()
+        Parameters
+        ----------
+        data : dict
+            The fields of the user hash
 
-        else:
-            raise ValueError("Both a Botogram User and a Telegram"
-                             " ID were passed, but they didn't match")
+        Raises
+        ------
+        TypeError
+            If last_activity is not a float
+        """
+
+        for name, value in self._parse(data).items():
+            if name not in self._dirty:
+                self._fields[name] = value
+        self._loaded = True
+        self._state = data.get("state")
+
+    def _load_deferred(self):
+        """Read every deferred field in a single round-trip, keeping the
+        ones already set
+
+        Raises
+        ------
+        TypeError
+            If last_activity is not a float
+        """
+
+        data = get_storage().fields(self.id, DEFERRED, self._consistent)
+        for name, value in self._parse(data).items():
+            self._fields.setdefault(name, value)
+        self._loaded = True
+
+    def save(self) -> bool:
+        """Write the changed attributes to redis in a single round-trip,
+        the user cache is updated as well
+
+        Returns
+        -------
+        bool
+            True if something was written, False if nothing changed
+        """
+
+        if not self._dirty:
+            return False
+        cache = get_cache()
+        get_storage().set_fields(self.id, {name: self._fields[name]
+                                           for name in self._dirty}, cache)
+        self._consistent = True      # Read the writes back from the primary
+        if cache is not None:
+            for name in self._dirty:
+                cache.update(self.id, name, self._fields[name])
+        self._dirty.clear()
+        return True
+
+    @staticmethod
+    def many(ids: Iterable[int], chunk_size: int = 500,
+             consistent: bool = False) -> List[Union[UserRecord, None]]:
+        """Get many users at once, reading the hashes of every chunk of ids
+        in a single round-trip
+
+        Parameters
+        ----------
+        ids : Iterable[int]
+            The Telegram IDs of the users
+        chunk_size : int, optional
+            How many hashes are read in every round-trip
+        consistent : bool, optional
+            Read the users from the primary, never from the replicas
+
+        Returns
+        -------
+        List[Union[UserRecord, None]]
+            The users, in the same order of ids, None if not present
+        """
+
+        return list(_record_or_none(get_storage().many(
+            ids, chunk_size, _consistent_read(consistent))))
+
+    def _create(self, fields: dict) -> dict:
+        """Write the new user hash, id included, with a single atomic
+        command, unless the user already exists
+
+        Parameters
+        ----------
+        fields : dict
+            The fields of the new user hash, as returned by new_user
+
+        Returns
+        -------
+        dict
+            The fields of the existing user hash, empty if the user was
+            created
+        """
+
+        existing = get_storage().create(fields)
+        self._consistent = True      # Read the new user from the primary
+        cache = get_cache()
+        if cache is not None:
+            cache.put(self.id, existing or {key: str(value) for key, value
+                                            in fields.items()})
+        return existing
 
     def _get_redis_value(self, key: str, type_of_return: type = str
                          ) -> Union[str, int, float, bool]:
@@ -195,25 +642,21 @@ class User:
             as such, raise a TypeError
         """
 
-        value = r.hget(self.redis_hash, key)     # Get the key value from Redis
-        if type_of_return is int:                # If it's requested as an int
-            try:                                 # Try to cast and return
-                return int(value)
-            except ValueError:
-                raise TypeError("The requested value from Redis is not an int")
-                # Alert if not possible
-        elif type_of_return is float:            # If it's requested as a float
-            try:                                 # Try to cast and return
-                return float(value)
-            except ValueError:
-                raise TypeError("The requested value "
-                                "from Redis is not a float")
-                # Alert if not possible
-        return value
+        cache = get_cache()
+        data = cache.get(self.id) if cache is not None else None
+        if data is not None and key in data:
+            value = data[key]                    # Get the key value cached
+        else:
+            value = get_storage().fields(self.id, (key,),
+                                         self._consistent)[key]
+            # Get it from the storage
+        return self._cast(value, type_of_return)
 
     def _set_redis_value(self, key: str, value: Union[str, int, float]
                          ) -> bool:
-        """Function which simplifies the redis hset function
+        """Function which simplifies the redis hset function, the user cache
+        is updated as well
+
         Parameters
         ----------
         key : str
@@ -228,22 +671,60 @@ class User:
             if an existing key was altered
         """
 
-        return r.hset(self.redis_hash, key, value)
+        cache = get_cache()
+        created = get_storage().set_fields(self.id, {key: value}, cache)
+        # The other processes drop the user from their cache
+        self._consistent = True
+        if cache is not None:
+            cache.update(self.id, key, value)
+        return bool(created)
+
+    def touch(self) -> float:
+        """Set the user's last activity to now. It's buffered and written to
+        redis, with the activity index, by the activity tracker
+
+        Returns
+        -------
+        float
+            The new last activity
+        """
 
-    def state(self, new_state: str = "") -> Union[str, bool]:
+        timestamp = get_tracker().touch(self.id)
+        self._fields["last_activity"] = timestamp
+        self._dirty.discard("last_activity")
+        # Not dirty, it's written by the tracker
+        cache = get_cache()
+        if cache is not None:
+            cache.update(self.id, "last_activity", timestamp)
+        return timestamp
+
+    def state(self, new_state: str = "", expected: Union[str, None] = None
+              ) -> Union[str, bool]:
         """Function which sets a new user state or returns the current one if
-        no new one is provided
+        no new one is provided. The state is set atomically together with
+        the set of the users in that state, so it must not be set with
+        _set_redis_value
+
         Parameters
         ----------
         new_state : str, optional
             The new state to be set, the current state is returned if it's not
             provided
+        expected : str, None, optional
+            Set the new state only if the current one is this, whatever it
+            is if None
 
         Returns
         -------
         Union[str, bool]
-            Returns a str representing the user's state or True if the
-            state was set successfully
+            Returns a str representing the user's state, True if the
+            state was set successfully or False if the current state wasn't
+            the expected one
+
+        Raises
+        ------
+        ValueError
+            If the user was deleted from redis
         """
 
         if not new_state:
@@ -252,7 +733,15 @@ class User:
             return self._get_redis_value("state")
             # Get the current one
 
-        self._set_redis_value("state", new_state)
-        # Otherwise set the new state
-
-        return True                                # Return True
+        cache = get_cache()
+        done, current = get_storage().transition(self.id, new_state,
+                                                 expected, cache)
+        # Otherwise set the new state in a single round-trip
+        self._consistent = True
+
+        if done < 0:
+            raise ValueError("User not found in the redis database")
+        self._state = new_state if done else current
+        if cache is not None:
+            cache.update(self.id, "state", self._state)
+        return bool(done)
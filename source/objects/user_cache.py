@@ -0,0 +1,295 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import redis
+# The listener survives the errors of the pub/sub connection
+
+from collections import OrderedDict
+# Needed to evict the least recently used users
+
+from threading import Lock
+# The invalidations arrive from the pub/sub thread
+
+from time import monotonic, sleep
+# Needed to expire the cached users and to wait for redis after an error
+
+from typing import Any, Dict, Union
+# Needed for parameters and return hints
+
+from uuid import uuid4
+# Needed to recognize the invalidations sent by this process
+
+CHANNEL = "user:invalidate"
+# The pub/sub channel shared by every process using the cache
+
+
+class UserCache:
+    """An in-process cache of the user hashes, keyed by Telegram id, with a
+    bounded size, LRU eviction and a TTL. The cached hashes are kept as
+    read from redis, so every value is a str.
+
+    Every process publishes the ids of the users it writes on CHANNEL and
+    the other ones drop them from their cache, so a user changed by another
+    worker is read again from redis. A user read from redis is cached only
+    if it wasn't invalidated during the read, see generation, and if the
+    subscription is lost every user is dropped.
+
+    Attributes
+    ----------
+    maxsize : int
+        How many users are kept
+    ttl : float
+        How many seconds a user is kept
+    hits : int
+        How many lookups were answered by the cache
+    misses : int
+        How many lookups had to go to redis
+
+    Methods
+    -------
+    get(user_id: int)
+        Get a cached user hash, None if not cached
+    generation() -> int
+        Get the current invalidation generation, before reading a user
+    put(user_id: int, data: dict, generation: int = None)
+        Cache a user hash, unless invalidated after generation
+    update(user_id: int, key: str, value: Any)
+        Change a field of a cached user hash, if cached
+    invalidate(user_id: int)
+        Drop a user from the cache
+    publish(connection: redis.Redis, user_id: int)
+        Tell the other processes to drop a user
+    listen(connection: redis.Redis)
+        Start dropping the users written by the other processes
+    stats()
+        Get the hit and miss counters
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0,
+                 channel: str = CHANNEL):
+        """
+        Initializes an empty cache
+
+        Parameters
+        ----------
+        maxsize : int, optional
+            How many users are kept
+        ttl : float, optional
+            How many seconds a user is kept
+        channel : str, optional
+            The pub/sub channel used for the invalidations
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.channel = channel
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        # user_id -> (expiry, data), the least recently used first
+        self._generation = 0
+        # Incremented by every invalidation
+        self._invalidated: "OrderedDict[int, int]" = OrderedDict()
+        # user_id -> generation of its last invalidation, at most maxsize
+        self._forgotten = 0
+        # The newest generation dropped from _invalidated
+        self._lock = Lock()
+        self._token = uuid4().hex
+        # Sent with every invalidation to skip the ones of this process
+        self._listener = None
+
+    def get(self, user_id: int) -> Union[Dict[str, str], None]:
+        """Get a cached user hash, counting the hit or the miss
+
+        Parameters
+        ----------
+        user_id : int
+            The Telegram id of the user
+
+        Returns
+        -------
+        Union[Dict[str, str], None]
+            The user hash, None if not cached or expired
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < monotonic():
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def generation(self) -> int:
+        """Get the current invalidation generation, to be taken before
+        reading a user from redis and passed to put
+
+        Returns
+        -------
+        int
+            The number of invalidations so far
+        """
+        with self._lock:
+            return self._generation
+
+    def put(self, user_id: int, data: Dict[str, str],
+            generation: Union[int, None] = None):
+        """Cache a user hash, evicting the least recently used one if full
+
+        Parameters
+        ----------
+        user_id : int
+            The Telegram id of the user
+        data : Dict[str, str]
+            The user hash, it must not be modified afterwards
+        generation : int, None, optional
+            The generation taken before reading the hash, it's not cached
+            if the user was invalidated since then, None to always cache it
+        """
+        with self._lock:
+            if (generation is not None and generation <
+                    self._invalidated.get(user_id, self._forgotten)):
+                return      # Changed during the read, the hash is stale
+            self._entries[user_id] = (monotonic() + self.ttl, data)
+            self._entries.move_to_end(user_id)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def update(self, user_id: int, key: str, value: Any):
+        """Change a field of a cached user hash, after writing it to redis
+
+        Parameters
+        ----------
+        user_id : int
+            The Telegram id of the user
+        key : str
+            The field written
+        value : Any
+            The value written, cached as str like redis returns it
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                data = dict(entry[1])
+                data[key] = str(value)
+                self._entries[user_id] = (entry[0], data)
+                # A new dict, since the old one may be in use
+
+    def invalidate(self, user_id: int):
+        """Drop a user from the cache
+
+        Parameters
+        ----------
+        user_id : int
+            The Telegram id of the user
+        """
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generation += 1
+            self._invalidated[user_id] = self._generation
+            self._invalidated.move_to_end(user_id)
+            if len(self._invalidated) > self.maxsize:
+                self._forgotten = self._invalidated.popitem(last=False)[1]
+
+    def _drop(self):
+        """Drop every user, the reads in progress are not cached either"""
+        with self._lock:
+            self._entries.clear()
+            self._invalidated.clear()
+            self._generation += 1
+            self._forgotten = self._generation
+
+    def clear(self):
+        """Drop every user and reset the counters"""
+        self._drop()
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def publish(self, connection, user_id: int):
+        """Tell the other processes to drop a user, can be queued on a
+        pipeline together with the write
+
+        Parameters
+        ----------
+        connection : redis.Redis, redis.client.Pipeline
+            Where the invalidation is published
+        user_id : int
+            The Telegram id of the user written
+        """
+        connection.publish(self.channel, f"{self._token} {user_id}")
+
+    def _on_message(self, message: dict):
+        """Drop the user of an invalidation sent by another process"""
+        token, _, user_id = str(message["data"]).partition(" ")
+        if token != self._token and user_id.isdigit():
+            self.invalidate(int(user_id))
+
+    def _on_error(self, error: BaseException, pubsub, thread):
+        """Drop every user when the pub/sub connection fails, since the
+        invalidations sent meanwhile are lost, and subscribe again. The
+        listener thread keeps running and retries every second"""
+        self._drop()
+        sleep(1.0)
+        try:
+            pubsub.subscribe(**{self.channel: self._on_message})
+        except redis.RedisError:
+            pass            # Still unreachable, the next error retries
+
+    def listen(self, connection):
+        """Start dropping the users written by the other processes, in a
+        daemon thread, if not already started
+
+        Parameters
+        ----------
+        connection : redis.Redis
+            The connection used to subscribe to the channel
+        """
+        if self._listener is None:
+            pubsub = connection.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.channel: self._on_message})
+            self._listener = pubsub.run_in_thread(
+                sleep_time=1.0, daemon=True, exception_handler=self._on_error)
+
+    def stop(self):
+        """Stop listening for the invalidations and drop every user, since
+        they can't be trusted anymore"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        self._drop()
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """Get the counters needed to tune the cache
+
+        Returns
+        -------
+        Dict[str, Union[int, float]]
+            The hits, the misses, the hit ratio and the cached users
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "ratio": self.hits / lookups if lookups else 0.0,
+                    "size": len(self._entries)}
@@ -0,0 +1,211 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from typing import Any, Dict, List, Union
+# Needed for parameters and return hints
+
+from source.objects.redis_connection import setting
+# The encoding is chosen in the redis config category
+
+CODES = {"id": "i", "first_name": "f", "last_name": "l", "username": "u",
+         "last_activity": "a", "state": "s"}
+# The field of the compact user hash of every field of the full one
+
+COMPACT = "compact"
+FULL = "full"
+
+CONVERT = """
+for i = 1, #ARGV - 1, 2 do
+    local value = redis.call('HGET', KEYS[1], ARGV[i])
+    if value then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+        if redis.call('HEXISTS', KEYS[1], ARGV[i + 1]) == 0 then
+            if ARGV[i + 1] == 'a' then
+                value = string.format('%d', math.floor(tonumber(value)))
+            end
+            redis.call('HSET', KEYS[1], ARGV[i + 1], value)
+        end
+    end
+end
+return redis.call('HLEN', KEYS[1])
+"""
+# Rename the fields of the hash KEYS[1] from ARGV[i] to ARGV[i + 1]. When
+# both are present the new one is kept: the conversion runs after the
+# encoding is configured, so it was written by the bot meanwhile
+
+_encoding: Union[str, None] = None
+
+
+def get_encoding() -> str:
+    """Get the encoding of the user hashes written by this process, from the
+    user-encoding key of the redis config category
+
+    Returns
+    -------
+    str
+        COMPACT, with the CODES fields and integer timestamps, or FULL
+    """
+
+    global _encoding
+    if _encoding is None:
+        _encoding = COMPACT if setting("user-encoding") == COMPACT else FULL
+    return _encoding
+
+
+def set_encoding(encoding: Union[str, None]):
+    """Set the encoding returned by get_encoding, None to read it again from
+    the config on the next call"""
+    global _encoding
+    _encoding = encoding
+
+
+def field(name: str, encoding: Union[str, None] = None) -> str:
+    """Get the name of a field in the user hash
+
+    Parameters
+    ----------
+    name : str
+        The full name of the field, like last_activity
+    encoding : str, optional
+        COMPACT or FULL, the configured one by default
+
+    Returns
+    -------
+    str
+        The field written in the hash
+    """
+
+    if (encoding or get_encoding()) == COMPACT:
+        return CODES.get(name, name)
+    return name
+
+
+def encode_value(name: str, value: Any, encoding: Union[str, None] = None
+                 ) -> Any:
+    """Get the value of a field as written in the user hash, the compact
+    encoding saves the timestamps as integers"""
+    if name == "last_activity" and (encoding or get_encoding()) == COMPACT:
+        return int(float(value))
+    return value
+
+
+def encode(fields: Dict[str, Any], encoding: Union[str, None] = None
+           ) -> Dict[str, Any]:
+    """Encode the fields of a user hash, in the same order
+
+    Parameters
+    ----------
+    fields : Dict[str, Any]
+        The fields, with their full names
+    encoding : str, optional
+        COMPACT or FULL, the configured one by default
+
+    Returns
+    -------
+    Dict[str, Any]
+        The fields as written in the hash
+    """
+
+    encoding = encoding or get_encoding()
+    if encoding == FULL:
+        return fields
+    return {field(name, encoding): encode_value(name, item, encoding)
+            for name, item in fields.items()}
+
+
+def twin(name: str, encoding: Union[str, None] = None
+         ) -> Union[str, None]:
+    """Get the name of a field in the other encoding, deleted whenever the
+    field is written so a hash never keeps both
+
+    Parameters
+    ----------
+    name : str
+        The full name of the field, like last_activity
+    encoding : str, optional
+        COMPACT or FULL, the configured one by default
+
+    Returns
+    -------
+    Union[str, None]
+        The field of the other encoding, None if it has a single name
+    """
+
+    if name not in CODES:
+        return None
+    return name if (encoding or get_encoding()) == COMPACT else CODES[name]
+
+
+def decode(data: Dict[str, str]) -> Dict[str, str]:
+    """Decode a user hash as returned by hgetall, in either encoding. If a
+    field is present with both names, the configured encoding wins.
+
+    Parameters
+    ----------
+    data : Dict[str, str]
+        The fields of the user hash
+
+    Returns
+    -------
+    Dict[str, str]
+        The fields with their full names
+    """
+
+    if not any(code in data for code in CODES.values()):
+        return data                   # Fast path, nothing to decode
+    decoded = dict(data)
+    full = get_encoding() == FULL
+    for name, code in CODES.items():
+        if code in decoded:
+            value = decoded.pop(code)
+            if not (full and name in decoded):
+                decoded[name] = value
+    return decoded
+
+
+def convert_args(encoding: str) -> List[str]:
+    """Get the ARGV of CONVERT to convert a hash to an encoding
+
+    Parameters
+    ----------
+    encoding : str
+        COMPACT or FULL
+
+    Returns
+    -------
+    List[str]
+        The arguments of the script
+    """
+
+    if encoding == COMPACT:
+        pairs = CODES.items()
+    else:
+        pairs = [(code, name) for name, code in CODES.items()]
+    return [item for pair in pairs for item in pair]
+
+
+def read_fields(name: str) -> List[str]:
+    """Get the fields to read with HMGET to find a field in either
+    encoding, the first one present wins, the configured encoding first"""
+    return [field(name), twin(name)] if name in CODES else [name]
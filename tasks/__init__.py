@@ -24,4 +24,8 @@ SOFTWARE.
 
 from .setup import setup
 from .lint import lint
-__all__ = ['lint', 'setup']
+from .bench import bench, bench_templates
+from .bundle import bundle
+from .users import encode_users, index_states, rebalance_users
+__all__ = ['bench', 'bench_templates', 'bundle', 'encode_users',
+           'index_states', 'lint', 'rebalance_users', 'setup']
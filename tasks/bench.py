@@ -0,0 +1,276 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import json
+import platform
+from contextlib import contextmanager
+from os import path as p
+from tempfile import TemporaryDirectory
+from timeit import repeat
+
+from invoke import task
+
+SIZES = (10, 1000, 10000)
+# How many statuses the synthetic catalogs of the suite have
+
+
+def _legacy_text_replace(text: str, textreplaces: dict) -> str:
+    """text_replace as it was before the templates were precompiled, kept
+    to compare the two"""
+    try:
+        text = text.format(**textreplaces)
+    except (KeyError, ValueError):
+        for key, textreplace in textreplaces.items():
+            text = text.replace("{" + key + "}", textreplace)
+    return text
+
+
+def _best(function, number: int, times: int = 5) -> float:
+    """Get the best time of a function in microseconds per call"""
+    return min(repeat(function, number=number, repeat=times)) / number * 1e6
+
+
+def _bench_screen(labels: list, datas: list, replaces: dict, number: int
+                  ) -> tuple:
+    """Time the rendering of a keyboard with both implementations
+
+    Returns
+    -------
+    tuple
+        The legacy and the compiled time, in microseconds per screen
+    """
+    from source.objects.template import Template
+
+    templates = [(Template.compile(label), Template.compile(data))
+                 for label, data in zip(labels, datas)]
+    legacy_replaces = dict(replaces, bot_username="bot")
+    # The legacy text_replace added the bot username to the dictionary
+
+    def legacy():
+        for label, data in zip(labels, datas):
+            _legacy_text_replace(label, legacy_replaces)
+            _legacy_text_replace(data, legacy_replaces)
+
+    def compiled():
+        for label, data in templates:
+            label.render(replaces)
+            data.render(replaces)
+
+    return _best(legacy, number), _best(compiled, number)
+
+
+@task
+def bench_templates(c, rows=8, columns=8, number=2000):
+    """Compare the legacy text_replace with the precompiled templates on a
+    keyboard of rows x columns buttons"""
+
+    rows, columns, number = int(rows), int(columns), int(number)
+    labels = [f"{{emoji}} Item {i} of {{name}}" if i % 2 else f"Static {i}"
+              for i in range(rows * columns)]
+    datas = [f"item:{i}:{{page}}" for i in range(rows * columns)]
+    screens = {
+        "all placeholders passed": {"emoji": "🔹", "name": "Bob",
+                                    "page": "3"},
+        "some placeholders missing": {"emoji": "🔹", "page": "3"},
+    }
+    print(f"[+] {rows}x{columns} keyboard, {number} renders")
+    for name, replaces in screens.items():
+        legacy_time, compiled_time = _bench_screen(labels, datas, replaces,
+                                                   number)
+        print(f"[+] {name}: legacy text_replace {legacy_time:.1f} us, "
+              f"compiled templates {compiled_time:.1f} us "
+              f"({legacy_time / compiled_time:.2f}x)")
+
+
+def _synthetic_status(index: int, rows: int, columns: int, state: str
+                      ) -> tuple:
+    """Get the language and callback entries of a synthetic status, half of
+    the buttons have placeholders and one every row is an url"""
+    labels, callbacks = [], []
+    for row in range(rows):
+        labels.append([{"text": f"Button {row}.{column} {{name}}"
+                        if column % 2 else f"Button {row}.{column}"}
+                       for column in range(columns)])
+        callbacks.append([{"type": "url", "callback":
+                           f"https://t.me/{{bot_username}}?start={index}"}
+                          if column == 0 else
+                          {"type": "callback", "callback": f"cb{column}",
+                           "data": f"{index}:{{page}}"}
+                          for column in range(columns)])
+    return ({"state": state, "text": f"Status {index} for {{name}} on "
+             "@{bot_username}", "buttons": labels, "notify": f"N{index}"},
+            {"state": state, "buttons": callbacks})
+
+
+def _synthetic_catalog(directory: str, statuses: int, languages: int,
+                       rows: int, columns: int) -> list:
+    """Write a synthetic catalog with 100 statuses per category, the first
+    one named like its category
+
+    Returns
+    -------
+    list
+        The full names of the statuses
+    """
+    lang_categories, callback_categories, names = [], [], []
+    for index in range(statuses):
+        if index % 100 == 0:
+            category = f"category{index // 100}"
+            lang_categories.append({"category": category, "status": []})
+            callback_categories.append({"category": category, "status": []})
+        lang_status, callback_status = _synthetic_status(
+            index, rows, columns,
+            category if index % 100 == 0 else f"status{index}")
+        lang_categories[-1]["status"].append(lang_status)
+        callback_categories[-1]["status"].append(callback_status)
+        names.append(f"{category}@{lang_status['state']}")
+    with open(p.join(directory, "callback.json"), "w") as j:
+        json.dump({"category": callback_categories}, j)
+    for lang in range(languages):
+        with open(p.join(directory, f"langL{lang}.json"), "w") as j:
+            json.dump({"lang": f"L{lang}", "error_msg": "Error",
+                       "error_button": "Error",
+                       "category": lang_categories,
+                       "role": [{"name": f"Role {level}", "emoji": "*"}
+                                for level in range(7)]}, j)
+    return names
+
+
+@contextmanager
+def _use_catalog(directory: str):
+    """Point the language module to a synthetic catalog"""
+    from source.objects import language
+    from source.objects.bot_username import set_bot_username
+    from source.objects.catalog import LanguageCatalog
+
+    set_bot_username("bench_bot")
+    default = language.catalog
+    language.catalog = LanguageCatalog(
+        directory, p.join(directory, "callback.json"), None, 3600,
+        lambda: {"bot_username": "bench_bot"})
+    try:
+        yield language
+    finally:
+        language.catalog = default
+
+
+def _check(language, names: list, replaces: dict):
+    """Raise a RuntimeError if a status of the synthetic catalog is not
+    found, so a broken index isn't timed as a fast one"""
+    for name in names[::100]:
+        if language.CallMess(name, "L0").message(replaces) == "Error":
+            raise RuntimeError(f"The status {name} was not found")
+
+
+def _bench_size(size: int, languages: int, rows: int, columns: int,
+                number: int) -> dict:
+    """Time the language layer on a synthetic catalog
+
+    Returns
+    -------
+    dict
+        The microseconds per call of every operation
+    """
+    with TemporaryDirectory() as directory:
+        names = _synthetic_catalog(directory, size, languages, rows, columns)
+        with _use_catalog(directory) as language:
+            def load():
+                language.catalog.clear()
+                for lang in range(languages):
+                    language.catalog.compiled(f"L{lang}")
+
+            results = {"load": _best(load, 1, 3)}
+            replaces = {"name": "Bob", "page": "2"}
+            _check(language, names, replaces)
+            status = names[len(names) // 2]
+            message = language.CallMess(status, "L0")
+            operations = {
+                "init": lambda: language.CallMess(status, "L0"),
+                "message": lambda: message.message(replaces),
+                "callback": lambda: message.callback(None, replaces,
+                                                     replaces),
+                "notify": message.notify,
+                "text_replace": lambda: language.text_replace(
+                    "Hello {name}, page {page} of @{bot_username}",
+                    replaces),
+            }
+            for name, operation in operations.items():
+                results[name] = _best(operation, number)
+    return {f"{size}/{name}": value for name, value in results.items()}
+
+
+def _compare(results: dict, baseline_path: str, tolerance: float) -> list:
+    """Print the results next to the baseline ones
+
+    Returns
+    -------
+    list
+        The names of the operations slower than the baseline by more than
+        tolerance
+    """
+    with open(baseline_path) as j:
+        baseline = json.load(j)["results"]
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline:
+            print(f"[?] {name}: {value:.2f} us (not in the baseline)")
+            continue
+        ratio = value / baseline[name]
+        print(f"[{'-' if ratio > 1 + tolerance else '+'}] {name}: "
+              f"{value:.2f} us, baseline {baseline[name]:.2f} us "
+              f"({ratio:.2f}x)")
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+@task
+def bench(c, sizes="", languages=3, rows=6, columns=4, number=2000,
+          output="", baseline="", tolerance=0.2):
+    """Time construction, lookup and rendering of CallMess and text_replace
+    on synthetic catalogs. The results are saved as json in output, and
+    compared with a baseline saved by a previous run: the task fails if an
+    operation is slower than the baseline by more than tolerance"""
+
+    sizes = [int(size) for size in sizes.split(",")] if sizes else SIZES
+    results = dict()
+    for size in sizes:
+        print(f"[+] Benchmarking {size} statuses")
+        results.update(_bench_size(size, int(languages), int(rows),
+                                   int(columns), int(number)))
+    report = {"python": platform.python_version(),
+              "settings": {"languages": int(languages), "rows": int(rows),
+                           "columns": int(columns)},
+              "results": results}
+    if output:
+        with open(output, "w") as j:
+            json.dump(report, j, indent=2)
+        print(f"[+] Results saved in {output}")
+    if baseline:
+        regressions = _compare(results, baseline, float(tolerance))
+        if regressions:
+            print(f"[-] {len(regressions)} operations are slower than the "
+                  "baseline")
+            exit(1)
+    elif not output:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,44 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+from invoke import task
+from source.objects.catalog import BUNDLE_PATH, build_bundle, save_bundle
+
+
+@task
+def bundle(c, language_dir="./data/language",
+           callback_path="./data/callback/callback.json", output=BUNDLE_PATH):
+    """Compile every language file and the callback file in a single
+    prevalidated bundle, loaded by the bot instead of the json files"""
+    print("[+] Compiling the language files")
+    compiled, errors = build_bundle(language_dir, callback_path)
+    if errors:
+        for error in errors:
+            print(f"[-] {error}")
+        print("[-] The bundle was not saved, fix the errors and try again")
+        exit(1)
+    save_bundle(compiled, output)
+    statuses = sum(len(language["statuses"])
+                   for language in compiled["languages"].values())
+    print(f"[+] {len(compiled['languages'])} languages and {statuses} "
+          f"statuses saved in {output}")
@@ -26,7 +26,9 @@ def setup(c):
     config.add_category("telegram")
     # Required Configuration from here
     config.telegram.add_keys({
-        "bot-token": input("[?] Insert your Telegram Bot Token: ")})
+        "bot-token": input("[?] Insert your Telegram Bot Token: "),
+        "bot-username": input("[?] Insert your Bot username, leave empty to "
+                              "get it from Telegram on first use: [] ")})
 
     config.add_category("redis")
 
@@ -0,0 +1,207 @@
+"""MIT License
+
+Copyright (c) 2020 Francesco Zimbolo A.K.A. Haloghen & Matteo Bocci A.K.A.
+matteob99
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import redis
+from invoke import task
+from source.objects.redis_connection import get_nodes, get_redis
+from source.objects.storage import ShardedRedisStorage, get_storage
+from source.objects.storage.redis_storage import ACTIVITY_KEY, STATE_SET
+from source.objects.user_encoding import (COMPACT, CONVERT, FULL,
+                                          convert_args, read_fields)
+
+
+def _clients() -> list:
+    """Get the clients of the nodes with the users, the shared one if they
+    are not sharded"""
+    return list(get_nodes().values()) or [get_redis()]
+
+
+def _states(client, keys: list) -> list:
+    """Get the state of some users, in either encoding, in a single
+    round-trip"""
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.hmget(key, read_fields("state"))
+    return [next((state for state in states if state), None)
+            for states in pipe.execute()]
+
+
+@task
+def index_states(c, count=1000):
+    """Rebuild the sets of the users in every state from the user hashes,
+    on every node, needed once for the users created before the sets
+    existed. The users changing state while it runs may be indexed twice,
+    so run it with the bot stopped"""
+    users = 0
+    for client in _clients():
+        print("[+] Deleting the old state sets")
+        for key in client.scan_iter(match=STATE_SET + "*", count=count):
+            client.delete(key)
+        print("[+] Indexing the users")
+        for batch in _batches(client, count):
+            pipe = client.pipeline(transaction=False)
+            for key, state in zip(batch, _states(client, batch)):
+                if state:
+                    pipe.sadd(STATE_SET + state, key[5:])
+            pipe.execute()
+            users += len(batch)
+    print(f"[+] {users} users indexed")
+
+
+def _move(source, storage: ShardedRedisStorage, keys: list):
+    """Move some user hashes from a node to the ones where the ring puts
+    them, with their state and activity, with a pipeline for every node"""
+    pipe = source.pipeline(transaction=False)
+    for key in keys:
+        pipe.dump(key)
+        pipe.pttl(key)
+        pipe.zscore(ACTIVITY_KEY, key[5:])
+    replies = pipe.execute()
+    states = _states(source, keys)
+    targets, cleanup = dict(), source.pipeline(transaction=False)
+    for index, key in enumerate(keys):
+        data, ttl, score = replies[index * 3:index * 3 + 3]
+        name = storage.ring.node(key)
+        if name not in targets:
+            targets[name] = storage.nodes[name].pipeline(transaction=False)
+        target = targets[name]
+        if data is not None:
+            target.restore(key, max(ttl, 0), data, replace=True)
+        if states[index]:
+            target.sadd(STATE_SET + states[index], key[5:])
+            cleanup.srem(STATE_SET + states[index], key[5:])
+        if score is not None:
+            target.zadd(ACTIVITY_KEY, {key[5:]: score})
+            cleanup.zrem(ACTIVITY_KEY, key[5:])
+        cleanup.delete(key)
+    for target in targets.values():
+        target.execute()
+    cleanup.execute()                 # Only once every copy is written
+
+
+@task
+def rebalance_users(c, count=1000, drain=""):
+    """Move every user to the node where the ring of the nodes key of the
+    redis config puts it, after adding or removing a node: the user hash
+    with DUMP and RESTORE, its state set membership and its activity. Pass
+    the URLs of the removed nodes, comma separated, as drain. The users
+    written while they're moved may lose the write, so run it with the bot
+    stopped"""
+    storage = get_storage()
+    if not isinstance(storage, ShardedRedisStorage):
+        print("[-] Set the nodes key of the redis config first")
+        exit(1)
+    sources = dict(storage.nodes)
+    for index, url in enumerate(filter(None, drain.split(","))):
+        sources[f"drained node {index + 1}"] = redis.Redis.from_url(
+            url, decode_responses=True)
+        # Not a name of the ring, so every user is moved
+    for name, client in sources.items():
+        moved = 0
+        for batch in _batches(client, count):
+            keys = [key for key in batch if storage.ring.node(key) != name]
+            if keys:
+                _move(client, storage, keys)
+                moved += len(keys)
+        print(f"[+] {moved} users moved from {name}")
+
+
+def _batches(client, count: int):
+    """Walk the user hash keys with SCAN, in lists of count keys"""
+    batch = []
+    for key in client.scan_iter(match="user:*", count=count):
+        if key[5:].isdigit():
+            batch.append(key)
+        if len(batch) >= count:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _sample(client, keys: list) -> list:
+    """Get the memory used by some keys and their encoding, in a single
+    round-trip"""
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.memory_usage(key)
+        pipe.object("encoding", key)
+    replies = pipe.execute()
+    return list(zip(replies[::2], replies[1::2]))
+
+
+def _convert(client, convert, args: list, keys: list, sample: int
+             ) -> tuple:
+    """Convert a batch of user hashes, sampling the memory used by the first
+    sample ones before and after
+
+    Returns
+    -------
+    tuple
+        The bytes used by the sampled hashes before and after and the
+        sampled hashes not kept as a listpack/ziplist
+    """
+    sampled = keys[:sample]
+    before = _sample(client, sampled) if sampled else []
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        convert(keys=[key], args=args, client=pipe)
+    pipe.execute()
+    after = _sample(client, sampled) if sampled else []
+    large = [key for key, (_, encoding) in zip(sampled, after)
+             if encoding not in ("listpack", "ziplist")]
+    return (sum(used or 0 for used, _ in before),
+            sum(used or 0 for used, _ in after), large)
+
+
+@task
+def encode_users(c, to=COMPACT, count=1000, sample=100):
+    """Convert every user hash in place to the compact or full encoding,
+    with SCAN and a pipeline of scripts for every batch, and report the
+    memory saved by sampling MEMORY USAGE. In both directions set
+    user-encoding to the new encoding and restart the bot first, then run
+    it: the fields the bot writes meanwhile are already in the new
+    encoding, drop their old twin and are kept if a hash has both"""
+    if to not in (COMPACT, FULL):
+        print(f"[-] The encoding must be {COMPACT} or {FULL}")
+        exit(1)
+    convert = get_redis().register_script(CONVERT)
+    args = convert_args(to)
+    users = sampled = before = after = 0
+    large = []
+    print(f"[+] Converting the users to the {to} encoding")
+    for client in _clients():
+        for batch in _batches(client, count):
+            used, saved, big = _convert(client, convert, args, batch,
+                                        sample - sampled)
+            users += len(batch)
+            sampled = min(sample, sampled + len(batch))
+            before, after, large = before + used, after + saved, large + big
+    print(f"[+] {users} users converted")
+    if sampled and before:
+        per_user = (before - after) / sampled
+        print(f"[+] {per_user:.1f} bytes saved per user on {sampled} "
+              f"sampled, about {per_user * users / 1024:.1f} KiB in total")
+    if large:
+        print(f"[-] {len(large)} sampled users aren't a listpack, like "
+              f"{large[0]}: raise hash-max-listpack-value")